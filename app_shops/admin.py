@@ -1,61 +1,129 @@
 from django.contrib import admin
-from app_shops.models import Shop, Item, File, Order, Cart, OrderedItem
+from app_shops.models import Tag, Shop, Item, File, Order, Cart, OrderedItem, ArchivedOrder, ArchivedOrderedItem
 from django.utils.translation import gettext_lazy as _
 
+from app_shops.paginators import EstimatedCountPaginator
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Admin of a table with many rows: estimated count on unfiltered lists, no second count on filtered ones."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class TagAdmin(admin.ModelAdmin):
+    list_display = ['name']
+    search_fields = ['name']
+
+    class Meta:
+        verbose_name = _('тег')
+        verbose_name_plural = _('теги')
+
 
 class ShopAdmin(admin.ModelAdmin):
     list_display = ['name', 'seller', 'tags', 'logo']
     list_display_links = ['name']
+    list_select_related = ['seller']
+    autocomplete_fields = ['seller']
+    search_fields = ['^name']
+    # filled from tags by signals
+    exclude = ['tag_list']
 
     class Meta:
         verbose_name = _('магазин')
         verbose_name_plural = _('магазины')
 
 
-class ItemAdmin(admin.ModelAdmin):
+class ItemAdmin(LargeTableAdmin):
     list_display = ['code', 'name', 'price', 'amount']
+    autocomplete_fields = ['shop']
+    # kept by orders, sync and the popularity command
+    readonly_fields = ['version', 'sold_total', 'sold_recent']
+    # PostgreSQL compares UPPER(name), so the prefix search does not use the index of name
+    search_fields = ['^name']
+
+    def get_search_results(self, request, queryset, search_term):
+        """Look a number up by the unique code, other terms by the start of the name."""
+        if search_term.strip().isdigit():
+            return queryset.filter(code=int(search_term)), False
+        return super().get_search_results(request, queryset, search_term)
 
     class Meta:
         verbose_name = _('товар')
         verbose_name_plural = _('товары')
 
 
-class FileAdmin(admin.ModelAdmin):
+class FileAdmin(LargeTableAdmin):
     list_display = ['item', 'file']
+    list_select_related = ['item']
+    autocomplete_fields = ['item']
 
     class Meta:
         verbose_name = _('файл')
         verbose_name_plural = _('файлы')
 
 
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(LargeTableAdmin):
     list_display = ['code', 'created', 'status', 'user']
     list_editable = ['status']
+    list_select_related = ['user']
+    autocomplete_fields = ['user']
+    # an exact match uses the index of code, =code compares UPPER(code)
+    search_fields = ['code__exact']
 
     class Meta:
         verbose_name = _('заказ')
         verbose_name_plural = _('заказы')
 
 
-class CartAdmin(admin.ModelAdmin):
+class CartAdmin(LargeTableAdmin):
     list_display = ['item', 'quantity', 'user']
+    list_select_related = ['item', 'user']
+    autocomplete_fields = ['item', 'user']
 
     class Meta:
         verbose_name = _('корзина')
         verbose_name_plural = _('корзина')
 
 
-class OrderedItemAdmin(admin.ModelAdmin):
+class OrderedItemAdmin(LargeTableAdmin):
     list_display = ['order', 'item', 'quantity', 'user', 'total_cost']
+    list_select_related = ['order', 'item', 'user']
+    autocomplete_fields = ['order', 'item', 'user']
 
     class Meta:
         verbose_name_plural = _('заказанные товары')
         verbose_name = _('заказанный товар')
 
 
+class ArchivedOrderAdmin(LargeTableAdmin):
+    list_display = ['code', 'created', 'status', 'user']
+    list_select_related = ['user']
+    autocomplete_fields = ['user']
+    # an exact match uses the index of code, =code compares UPPER(code)
+    search_fields = ['code__exact']
+
+    class Meta:
+        verbose_name = _('архивный заказ')
+        verbose_name_plural = _('архивные заказы')
+
+
+class ArchivedOrderedItemAdmin(LargeTableAdmin):
+    list_display = ['order', 'item', 'quantity', 'user', 'total_cost']
+    list_select_related = ['order', 'item', 'user']
+    autocomplete_fields = ['order', 'item', 'user']
+
+    class Meta:
+        verbose_name_plural = _('архивные заказанные товары')
+        verbose_name = _('архивный заказанный товар')
+
+
+admin.site.register(Tag, TagAdmin)
 admin.site.register(Shop, ShopAdmin)
 admin.site.register(Item, ItemAdmin)
 admin.site.register(File, FileAdmin)
 admin.site.register(Order, OrderAdmin)
 admin.site.register(Cart, CartAdmin)
 admin.site.register(OrderedItem, OrderedItemAdmin)
+admin.site.register(ArchivedOrder, ArchivedOrderAdmin)
+admin.site.register(ArchivedOrderedItem, ArchivedOrderedItemAdmin)
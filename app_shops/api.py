@@ -0,0 +1,149 @@
+"""Read-only JSON API of the catalog.
+
+Lists are paginated with an opaque cursor (``?cursor=``, ``?limit=``),
+``?fields=name,price`` selects the returned fields. Rows are read with
+``values()`` without creating model instances, responses are gzipped and
+carry an ETag built from the catalog version.
+"""
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as Base64Error
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.http import JsonResponse
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition, require_GET
+
+from app_shops.catalog import get_version
+from app_shops.models import Shop, Item, File
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+SHOP_FIELDS = ('id', 'name', 'tags', 'logo')
+ITEM_FIELDS = ('id', 'code', 'name', 'description', 'price', 'shop_id',
+               'is_promotion', 'is_offer', 'images')
+
+
+def api_etag(request, *args, **kwargs):
+    return str(get_version())
+
+
+def _encode_cursor(pk):
+    return urlsafe_b64encode(str(pk).encode()).decode()
+
+
+def _decode_cursor(cursor):
+    try:
+        return int(urlsafe_b64decode(cursor.encode()).decode())
+    except (Base64Error, UnicodeDecodeError, ValueError):
+        raise ValueError('invalid cursor')
+
+
+def _get_fields(request, allowed):
+    """Return fields requested with ?fields= or all allowed fields."""
+    fields = request.GET.get('fields')
+    if not fields:
+        return list(allowed)
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError(f'unknown fields: {", ".join(unknown)}')
+    return fields
+
+
+def _get_limit(request):
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise ValueError('invalid limit')
+    if limit < 1:
+        raise ValueError('invalid limit')
+    return min(limit, MAX_LIMIT)
+
+
+def _media_url(name):
+    return f'{settings.MEDIA_URL}{name}' if name else None
+
+
+def _add_images(rows):
+    """Add list of image urls to every item row with one query."""
+    images = {row['id']: [] for row in rows}
+    files = File.objects.filter(item_id__in=images).order_by('id').values_list('item_id', 'file')
+    for item_id, file in files:
+        images[item_id].append(_media_url(file))
+    for row in rows:
+        row['images'] = images[row['id']]
+
+
+def _page(request, queryset, allowed):
+    """Return JSON response with a page of the queryset."""
+    try:
+        fields = _get_fields(request, allowed)
+        limit = _get_limit(request)
+        cursor = request.GET.get('cursor')
+        if cursor:
+            queryset = queryset.filter(pk__gt=_decode_cursor(cursor))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    db_fields = ['id'] + [field for field in fields if field not in ('id', 'images')]
+    rows = list(queryset.order_by('pk').values(*db_fields)[:limit + 1])
+    next_url = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        params = request.GET.copy()
+        params['cursor'] = _encode_cursor(rows[-1]['id'])
+        next_url = f'{request.path}?{params.urlencode()}'
+
+    if 'images' in fields:
+        _add_images(rows)
+    if 'logo' in fields:
+        for row in rows:
+            row['logo'] = _media_url(row['logo'])
+    if 'id' not in fields:
+        for row in rows:
+            del row['id']
+    return JsonResponse({'results': rows, 'next': next_url})
+
+
+def _items_with_images():
+    return Item.objects.filter(Exists(File.objects.filter(item_id=OuterRef('pk'))))
+
+
+@require_GET
+@gzip_page
+@condition(etag_func=api_etag)
+def shops_api(request):
+    """List of shops."""
+    return _page(request, Shop.objects.all(), SHOP_FIELDS)
+
+
+@require_GET
+@gzip_page
+@condition(etag_func=api_etag)
+def items_api(request):
+    """List of items, ?shop= filters items of one shop."""
+    queryset = Item.objects.all()
+    shop_id = request.GET.get('shop')
+    if shop_id:
+        if not shop_id.isdigit():
+            return JsonResponse({'error': 'invalid shop'}, status=400)
+        queryset = queryset.filter(shop_id=shop_id)
+    return _page(request, queryset, ITEM_FIELDS)
+
+
+@require_GET
+@gzip_page
+@condition(etag_func=api_etag)
+def promotions_api(request):
+    """List of promotions, the same items as on the promotions page."""
+    return _page(request, _items_with_images().filter(is_promotion=True), ITEM_FIELDS)
+
+
+@require_GET
+@gzip_page
+@condition(etag_func=api_etag)
+def offers_api(request):
+    """List of special offers, the same items as on the offers page."""
+    return _page(request, _items_with_images().filter(is_offer=True), ITEM_FIELDS)
@@ -7,3 +7,8 @@ class AppShopsConfig(AppConfig):
     name = 'app_shops'
     verbose_name = _('магазины')
 
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from app_shops import signals  # noqa: F401
+        from app_shops.slow_queries import install
+        connection_created.connect(install, dispatch_uid='app_shops.slow_queries')
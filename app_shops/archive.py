@@ -0,0 +1,60 @@
+"""Archiving of old bought orders.
+
+Orders are moved with their OrderedItem rows into ArchivedOrder and
+ArchivedOrderedItem in small batches, each in its own short transaction,
+so writers are never blocked for long.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone as tz
+
+from app_shops.models import Order, OrderedItem, ArchivedOrder, ArchivedOrderedItem
+
+ORDER_FIELDS = ['id', 'code', 'created', 'status', 'user_id']
+ORDERED_ITEM_FIELDS = ['id', 'order_id', 'item_id', 'quantity', 'user_id', 'total_cost']
+
+
+def archive_cutoff(days=None):
+    """Return time before which bought orders are archived."""
+    if days is None:
+        days = settings.ORDER_ARCHIVE_AFTER_DAYS
+    return tz.now() - timedelta(days=days)
+
+
+def archive_batch(cutoff, batch_size):
+    """Move one batch of orders to archive. Return number of moved orders."""
+    with transaction.atomic():
+        order_ids = list(Order.objects.filter(status='b', created__lt=cutoff).
+                         order_by('created').values_list('id', flat=True)[:batch_size])
+        if not order_ids:
+            return 0
+        orders = Order.objects.filter(id__in=order_ids).values(*ORDER_FIELDS)
+        ArchivedOrder.objects.bulk_create([ArchivedOrder(**order) for order in orders])
+        ordered_items = OrderedItem.objects.filter(order_id__in=order_ids).values(*ORDERED_ITEM_FIELDS)
+        ArchivedOrderedItem.objects.bulk_create([ArchivedOrderedItem(**ordered_item)
+                                                 for ordered_item in ordered_items])
+        OrderedItem.objects.filter(order_id__in=order_ids).delete()
+        Order.objects.filter(id__in=order_ids).delete()
+    return len(order_ids)
+
+
+def archive_orders(cutoff=None, batch_size=None, pause=0):
+    """Move all bought orders created before cutoff to archive.
+
+    pause is a delay in seconds between batches to let other writers in.
+    """
+    if cutoff is None:
+        cutoff = archive_cutoff()
+    if batch_size is None:
+        batch_size = settings.ORDER_ARCHIVE_BATCH_SIZE
+    archived = 0
+    while True:
+        moved = archive_batch(cutoff, batch_size)
+        archived += moved
+        if moved < batch_size:
+            return archived
+        if pause:
+            time.sleep(pause)
@@ -0,0 +1,60 @@
+"""Item cards.
+
+A card is a compact record with everything listing pages show about an item:
+name, price, first image, shop and promotion/offer flags. Cards are kept in
+the cache, rebuilt on demand and dropped by signals once changes of Item, File
+or Shop are committed, so a page of items is rendered from a single
+``get_many`` lookup.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+from app_shops.models import Item, File
+
+ITEM_CARD_TIMEOUT = 60 * 60 * 24
+
+
+def _card_key(item_id):
+    return f'item_card:{item_id}'
+
+
+def build_cards(item_ids):
+    """Build cards of the given items from the database."""
+    cards = dict()
+    items = Item.objects.filter(id__in=item_ids).values(
+        'id', 'name', 'price', 'amount', 'shop_id', 'shop__name', 'is_promotion', 'is_offer')
+    for item in items:
+        cards[item['id']] = {'item_id': item['id'],
+                             'item_name': item['name'],
+                             'item_price': item['price'],
+                             'amount': item['amount'],
+                             'shop_id': item['shop_id'],
+                             'shop_name': item['shop__name'],
+                             'is_promotion': item['is_promotion'],
+                             'is_offer': item['is_offer'],
+                             'file': ''}
+    # first image of each item
+    files = File.objects.filter(item_id__in=item_ids).order_by('-id').values_list('item_id', 'file')
+    for item_id, file in files:
+        cards[item_id]['file'] = file
+    return cards
+
+
+def get_cards(item_ids):
+    """Return cards of the items in the order of item_ids."""
+    item_ids = list(item_ids)
+    keys = {_card_key(item_id): item_id for item_id in item_ids}
+    cards = {keys[key]: card for key, card in cache.get_many(keys).items()}
+    missing = [item_id for item_id in item_ids if item_id not in cards]
+    if missing:
+        built = build_cards(missing)
+        cache.set_many({_card_key(item_id): card for item_id, card in built.items()},
+                       ITEM_CARD_TIMEOUT)
+        cards.update(built)
+    return [cards[item_id] for item_id in item_ids if item_id in cards]
+
+
+def invalidate_cards(item_ids):
+    """Drop cards of the items when the transaction is committed, they will be rebuilt on the next request."""
+    keys = [_card_key(item_id) for item_id in item_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,84 @@
+"""Buffer of items added to cart.
+
+Adds are kept in the session as {item id: quantity} and written to Cart in
+one batch when the buffer grows or gets old, when the cart is shown and when
+the user logs in or out. Anonymous visitors get a cart too, it is merged into the
+cart of the user at login.
+"""
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from app_shops.models import Item, Cart
+
+CART_BUFFER_KEY = 'cart_buffer'
+CART_BUFFER_SINCE_KEY = 'cart_buffer_since'
+# number of items and age in seconds of the buffer to write it to Cart
+CART_BUFFER_SIZE = getattr(settings, 'CART_BUFFER_SIZE', 10)
+CART_BUFFER_MAX_AGE = getattr(settings, 'CART_BUFFER_MAX_AGE', 60 * 5)
+
+
+def buffered_items(request):
+    """Return {item id: quantity} of items not written to Cart yet."""
+    return {int(item_id): quantity for item_id, quantity in request.session.get(CART_BUFFER_KEY, {}).items()}
+
+
+def add_to_cart(request, item_id, quantity=1):
+    """Add item to the cart buffer, return False if item_id is not valid."""
+    try:
+        item_id = int(item_id)
+    except (TypeError, ValueError):
+        return False
+    if item_id <= 0 or quantity <= 0:
+        return False
+    buffer = request.session.get(CART_BUFFER_KEY, {})
+    # session is stored as JSON, keys are strings
+    buffer[str(item_id)] = buffer.get(str(item_id), 0) + quantity
+    request.session[CART_BUFFER_KEY] = buffer
+    since = request.session.setdefault(CART_BUFFER_SINCE_KEY, time.time())
+    if len(buffer) >= CART_BUFFER_SIZE or time.time() - since >= CART_BUFFER_MAX_AGE:
+        flush_cart(request)
+    return True
+
+
+def flush_cart(request, user=None):
+    """Write the buffer to Cart of the user, increasing quantity of items already there."""
+    user = user or request.user
+    buffer = buffered_items(request)
+    if not buffer or not user.is_authenticated:
+        return
+    with transaction.atomic():
+        # items could be deleted since they were added
+        item_ids = set(Item.objects.filter(id__in=buffer).values_list('id', flat=True))
+        carts = Cart.objects.select_for_update().filter(user_id=user.id, item_id__in=item_ids)
+        changed = []
+        for cart in carts:
+            cart.quantity += buffer[cart.item_id]
+            changed.append(cart)
+            item_ids.discard(cart.item_id)
+        Cart.objects.bulk_update(changed, ['quantity'])
+        Cart.objects.bulk_create([Cart(user_id=user.id, item_id=item_id, quantity=buffer[item_id])
+                                  for item_id in sorted(item_ids)])
+    request.session.pop(CART_BUFFER_KEY, None)
+    request.session.pop(CART_BUFFER_SINCE_KEY, None)
+
+
+def cart_lines(request):
+    """Return {item id: (quantity, price)} of the cart together with the buffer."""
+    buffer = buffered_items(request)
+    lines = {}
+    if request.user.is_authenticated:
+        carts = Cart.objects.filter(user_id=request.user.id).values_list('item_id', 'quantity', 'item__price')
+        for item_id, quantity, price in carts:
+            lines[item_id] = (quantity + buffer.pop(item_id, 0), price)
+    for item_id, price in Item.objects.filter(id__in=buffer).values_list('id', 'price'):
+        lines[item_id] = (buffer[item_id], price)
+    return lines
+
+
+def discard_from_buffer(request, item_id):
+    """Remove item from the buffer."""
+    buffer = request.session.get(CART_BUFFER_KEY, {})
+    if buffer.pop(str(item_id), None) is not None:
+        request.session[CART_BUFFER_KEY] = buffer
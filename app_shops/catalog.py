@@ -0,0 +1,92 @@
+"""Catalog version counters.
+
+Every write to Shop, Item or File bumps the global catalog version and the
+versions of the shop and item it touches. Catalog pages build their ETag from
+these counters, so a conditional GET is answered without querying item tables.
+The counters must live in a cache shared by all worker processes. They are
+bumped after the write is committed: a reader bumped before the commit could
+cache a page of old rows under the new version.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import get_language
+
+from app_shops.locks import lock
+
+CATALOG_VERSION_KEY = 'catalog_version'
+VERSION_LOCK_TIMEOUT = 5
+
+
+def _version_key(scope=None, pk=None):
+    if scope is None:
+        return CATALOG_VERSION_KEY
+    return f'{CATALOG_VERSION_KEY}:{scope}:{pk}'
+
+
+def _initial_version():
+    # Start from the current time, so a counter evicted from the cache
+    # never comes back with a value an old ETag was built from.
+    return time.time_ns() // 1000
+
+
+def get_version(scope=None, pk=None):
+    """Return current version of the catalog, a shop or an item."""
+    key = _version_key(scope, pk)
+    version = cache.get(key)
+    if version is None:
+        # seeded under a lock, add of the file cache is not atomic
+        with lock(key, VERSION_LOCK_TIMEOUT):
+            version = cache.get(key)
+            if version is None:
+                version = _initial_version()
+                cache.set(key, version, None)
+    return version
+
+
+def get_versions(scope, pks):
+    """Return {pk: version} of several objects with one cache lookup."""
+    keys = {_version_key(scope, pk): pk for pk in pks}
+    versions = {keys[key]: version for key, version in cache.get_many(keys).items()}
+    for pk in pks:
+        if pk not in versions:
+            versions[pk] = get_version(scope, pk)
+    return versions
+
+
+def bump_version(scope=None, pk=None):
+    """Give the catalog, a shop or an item a new version."""
+    # A new time based value instead of incr: incr of the file cache is not
+    # atomic, concurrent writes could end with a version seen before.
+    version = max(_initial_version(), (cache.get(_version_key(scope, pk)) or 0) + 1)
+    cache.set(_version_key(scope, pk), version, None)
+    return version
+
+
+def bump_catalog(shop_id=None, item_id=None):
+    """Mark the catalog, the shop and the item as changed when the transaction is committed."""
+    def bump():
+        bump_version()
+        if shop_id is not None:
+            bump_version('shop', shop_id)
+        if item_id is not None:
+            bump_version('item', item_id)
+
+    transaction.on_commit(bump)
+
+
+def version_etag(request, version):
+    """ETag of a page rendered from the given version for the current user and language."""
+    user_id = request.user.pk if request.user.is_authenticated else 0
+    return f'{get_language()}-{user_id}-{version}'
+
+
+def catalog_etag(request, *args, **kwargs):
+    """ETag of pages built from the whole catalog."""
+    return version_etag(request, get_version())
+
+
+def shop_etag(request, pk, *args, **kwargs):
+    """ETag of pages built from items of one shop."""
+    return version_etag(request, get_version('shop', pk))
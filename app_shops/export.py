@@ -0,0 +1,87 @@
+"""Streaming export of shop items and sales.
+
+Rows are read with ``iterator()`` in chunks and written straight into
+``StreamingHttpResponse``, so memory does not depend on the shop size.
+Items are exported in the column layout accepted by upload_item_from_file.
+"""
+import csv
+import json
+from itertools import chain
+
+from django.contrib.auth.decorators import login_required, permission_required
+from django.core.exceptions import PermissionDenied
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+
+from app_shops.models import Shop, Item, OrderedItem, ArchivedOrderedItem
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+# the same columns as in the file for upload_item_from_file
+ITEM_COLUMNS = ['code', 'name', 'price', 'description', 'amount']
+SALES_COLUMNS = ['order', 'created', 'code', 'name', 'quantity', 'total_cost']
+SALES_FIELDS = ['order__code', 'order__created', 'item__code', 'item__name', 'quantity', 'total_cost']
+
+
+class Echo:
+    """Pseudo-buffer which returns the written value instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_rows(rows, header=None):
+    writer = csv.writer(Echo(), quotechar='"')
+    if header:
+        yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _jsonl_rows(rows, columns):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def _get_own_shop(request, pk):
+    shop = get_object_or_404(Shop, id=pk)
+    if shop.seller_id != request.user.id:
+        raise PermissionDenied
+    return shop
+
+
+def _export_response(rows, columns, file_format, filename, header=True):
+    if file_format not in EXPORT_FORMATS:
+        raise Http404
+    if file_format == 'csv':
+        content = _csv_rows(rows, columns if header else None)
+    else:
+        content = _jsonl_rows(rows, columns)
+    response = StreamingHttpResponse(content, content_type=EXPORT_FORMATS[file_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{file_format}"'
+    return response
+
+
+@login_required
+@permission_required(['app_shops.change_shop', 'app_shops.change_item'], raise_exception=True)
+def export_items(request, pk, file_format):
+    """Export items of the shop. CSV is written without header to be uploaded back."""
+    shop = _get_own_shop(request, pk)
+    rows = Item.objects.filter(shop_id=shop.id).order_by('code').\
+        values_list(*ITEM_COLUMNS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    return _export_response(rows, ITEM_COLUMNS, file_format, f'shop_{shop.id}_items', header=False)
+
+
+@login_required
+@permission_required(['app_shops.change_shop', 'app_shops.change_item'], raise_exception=True)
+def export_sales(request, pk, file_format):
+    """Export items of the shop sold in paid orders, archived orders first."""
+    shop = _get_own_shop(request, pk)
+    archived = ArchivedOrderedItem.objects.filter(item__shop_id=shop.id).order_by('id').\
+        values_list(*SALES_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    live = OrderedItem.objects.filter(item__shop_id=shop.id, order__status='b').order_by('id').\
+        values_list(*SALES_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    rows = chain(archived, live)
+    return _export_response(rows, SALES_COLUMNS, file_format, f'shop_{shop.id}_sales')
@@ -0,0 +1,158 @@
+"""Facets of the catalog filter and their counts.
+
+Every item belongs to facets: its shop, tags of its shop, price range,
+promotion, offer and in stock. The count of a facet is the number of items
+matching the active filter with this facet chosen instead of the current
+choice of its group, e.g. counts of shops ignore the chosen shop but respect
+the price and the flags. Counts of one filter take an aggregate and two
+GROUP BY queries and are cached with a version of their own. It is bumped
+only by writes moving an item to other facets: a sale keeps the counts unless
+it sells the last unit of an item.
+"""
+from hashlib import md5
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+
+from app_shops.catalog import bump_version, get_version
+from app_shops.models import Shop, Item, Tag
+
+FACET_CACHE_TIMEOUT = 60 * 15
+# fields of Item deciding its facets, amount only by being above zero
+FACET_FIELDS = ('shop_id', 'price', 'is_promotion', 'is_offer', 'amount')
+FLAGS = {'promotion': Q(is_promotion=True), 'offer': Q(is_offer=True), 'in_stock': Q(amount__gt=0)}
+
+# (min, max) price of every price facet, max is not included
+PRICE_RANGES = [(0, 100), (100, 500), (500, 1000), (1000, 5000), (5000, None)]
+
+
+def _price_q(price_min, price_max):
+    q = Q()
+    if price_min is not None:
+        q &= Q(price__gte=price_min)
+    if price_max is not None:
+        q &= Q(price__lt=price_max)
+    return q
+
+
+def _tag_q(tag_id):
+    return Q(shop_id__in=Shop.tag_list.through.objects.filter(tag_id=tag_id).values('shop_id'))
+
+
+def filter_groups(data):
+    """Return {group: Q} of the active filter, data is cleaned data of CatalogFilterForm."""
+    groups = {}
+    if data.get('price_min') is not None or data.get('price_max') is not None:
+        groups['price'] = _price_q(data.get('price_min'), data.get('price_max'))
+    if data.get('shop') is not None:
+        groups['shop'] = Q(shop_id=data['shop'])
+    if data.get('tag') is not None:
+        groups['tag'] = _tag_q(data['tag'])
+    for name, q in FLAGS.items():
+        if data.get(name):
+            groups[name] = q
+    return groups
+
+
+def filter_q(data, exclude=()):
+    """Return Q of the active filter without groups in exclude."""
+    q = Q()
+    for group, group_q in filter_groups(data).items():
+        if group not in exclude:
+            q &= group_q
+    return q
+
+
+def _filter_key(data):
+    normalized = repr(sorted((name, str(value)) for name, value in data.items()
+                             if value is not None and value is not False))
+    return f'facets:{get_version("facets", "all")}:{md5(normalized.encode()).hexdigest()}'
+
+
+def changes_facets(old, new):
+    """Return whether an item moves to other facets, old and new are {field: value}."""
+    for name, value in new.items():
+        if name == 'amount':
+            if (old[name] > 0) != (value > 0):
+                return True
+        elif name in FACET_FIELDS and old[name] != value:
+            return True
+    return False
+
+
+def bump_facets():
+    """Make facets be counted again when the transaction is committed."""
+    transaction.on_commit(lambda: bump_version('facets', 'all'))
+
+
+def compute_facet_counts(data):
+    """Count items of every facet for the filter, return labels and counts."""
+    groups = filter_groups(data)
+    labels = {'promotion': '', 'offer': '', 'in_stock': ''}
+    for index, (price_min, price_max) in enumerate(PRICE_RANGES):
+        labels[f'price:{index}'] = f'{price_min} - {price_max}' if price_max is not None else f'{price_min} +'
+    for shop_id, shop_name in Shop.objects.values_list('id', 'name'):
+        labels[f'shop:{shop_id}'] = shop_name
+    for tag_id, tag_name in Tag.objects.values_list('id', 'name'):
+        labels[f'tag:{tag_id}'] = tag_name
+    counts = dict.fromkeys(labels, 0)
+
+    # price and flags are counted in one pass over items of the chosen shop and tag
+    def others(own):
+        q = Q()
+        for group, group_q in groups.items():
+            if group not in ('shop', 'tag', own):
+                q &= group_q
+        return q
+
+    aggregates = {f'price:{index}': Count('id', filter=others('price') & _price_q(price_min, price_max))
+                  for index, (price_min, price_max) in enumerate(PRICE_RANGES)}
+    aggregates.update({name: Count('id', filter=others(name) & q) for name, q in FLAGS.items()})
+    counts.update(Item.objects.filter(filter_q(data, exclude=set(groups) - {'shop', 'tag'})).
+                  aggregate(**aggregates))
+    shop_counts = Item.objects.filter(filter_q(data, exclude={'shop'})).values_list('shop_id').\
+        annotate(number=Count('id')).order_by()
+    for shop_id, number in shop_counts:
+        counts[f'shop:{shop_id}'] = number
+    tag_counts = Item.objects.filter(filter_q(data, exclude={'tag'}), shop__tag_list__isnull=False).\
+        values_list('shop__tag_list').annotate(number=Count('id')).order_by()
+    for tag_id, number in tag_counts:
+        counts[f'tag:{tag_id}'] = number
+    return labels, counts
+
+
+def get_facets(data=None):
+    """Return facets with labels and number of items for the filter form."""
+    data = data or {}
+    key = _filter_key(data)
+    cached = cache.get(key)
+    if cached is None:
+        cached = compute_facet_counts(data)
+        cache.set(key, cached, FACET_CACHE_TIMEOUT)
+    labels, counts = cached
+
+    facets = {'shops': [], 'tags': [], 'prices': []}
+    for name, label in labels.items():
+        kind, _, value = name.partition(':')
+        if kind == 'shop':
+            facets['shops'].append({'id': int(value), 'label': label, 'count': counts[name]})
+        elif kind == 'tag':
+            facets['tags'].append({'id': int(value), 'label': label, 'count': counts[name]})
+        elif kind == 'price':
+            price_min, price_max = PRICE_RANGES[int(value)]
+            facets['prices'].append({'min': price_min, 'max': price_max,
+                                     'label': label, 'count': counts[name]})
+        else:
+            facets[name] = counts[name]
+    facets['shops'].sort(key=lambda facet: facet['label'])
+    facets['tags'].sort(key=lambda facet: facet['label'])
+    return facets
+
+
+def set_shop_tags(shop):
+    """Fill Shop.tag_list from comma separated Shop.tags."""
+    names = {name.strip().lower() for name in shop.tags.split(',')}
+    names.discard('')
+    Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+    shop.tag_list.set(Tag.objects.filter(name__in=names))
@@ -1,6 +1,7 @@
 from django import forms
 from django.core.exceptions import ValidationError
 
+from app_shops.facets import filter_q
 from app_shops.models import Item
 from django.utils.translation import gettext_lazy as _
 
@@ -32,3 +33,18 @@ class TimeInterval(forms.Form):
             if second_date < first_date:
                 raise ValidationError(_('последняя дата не должна быть меньше первой'))
             return second_date
+
+
+class CatalogFilterForm(forms.Form):
+    """Filter items of the catalog by facets."""
+    price_min = forms.DecimalField(min_value=0, required=False, label=_('цена от'))
+    price_max = forms.DecimalField(min_value=0, required=False, label=_('цена до'))
+    shop = forms.IntegerField(required=False, widget=forms.HiddenInput)
+    tag = forms.IntegerField(required=False, widget=forms.HiddenInput)
+    promotion = forms.BooleanField(required=False, label=_('акция'))
+    offer = forms.BooleanField(required=False, label=_('специальное предложение'))
+    in_stock = forms.BooleanField(required=False, label=_('в наличии'))
+
+    def filter(self, queryset):
+        """Return items of queryset matching cleaned data."""
+        return queryset.filter(filter_q(self.cleaned_data))
@@ -0,0 +1,70 @@
+"""Locks shared by the worker processes.
+
+``cache.add`` is atomic on memcached and Redis, but FileBasedCache implements
+it as ``has_key`` followed by ``set``, so two workers may both take a lock.
+With the file cache the lock is an flock of a file in LOCKS_DIR instead: the
+kernel grants it to one process at a time and drops it when the process dies.
+Names are hashed into LOCK_SLOTS files, so the directory does not grow with
+the number of pages; two names sharing a slot only wait for each other.
+"""
+import fcntl
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.filebased import FileBasedCache
+
+LOCKS_DIR = getattr(settings, 'LOCKS_DIR', os.path.join(tempfile.gettempdir(), 'djloggingprofiling-locks'))
+LOCK_SLOTS = 4096
+LOCK_POLL_INTERVAL = 0.05
+
+
+def _slot_path(name):
+    slot = int(md5(name.encode()).hexdigest(), 16) % LOCK_SLOTS
+    return os.path.join(LOCKS_DIR, f'{slot}.lock')
+
+
+@contextmanager
+def _file_lock(name, blocking):
+    os.makedirs(LOCKS_DIR, exist_ok=True)
+    descriptor = os.open(_slot_path(name), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        try:
+            fcntl.flock(descriptor, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+        else:
+            yield True
+    finally:
+        # closing the descriptor releases the lock
+        os.close(descriptor)
+
+
+@contextmanager
+def _cache_lock(name, timeout, blocking):
+    key = f'lock:{name}'
+    locked = cache.add(key, 1, timeout)
+    deadline = time.monotonic() + timeout
+    while not locked and blocking and time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        locked = cache.add(key, 1, timeout)
+    try:
+        yield locked
+    finally:
+        if locked:
+            cache.delete(key)
+
+
+def lock(name, timeout, blocking=True):
+    """Hold the named lock for the ``with`` block, yield whether it was taken.
+
+    ``timeout`` bounds how long a crashed holder keeps a cache lock and how
+    long a blocking call waits for it.
+    """
+    if isinstance(caches['default'], FileBasedCache):
+        return _file_lock(name, blocking)
+    return _cache_lock(name, timeout, blocking)
@@ -0,0 +1,178 @@
+"""Incremental statistics of the log file.
+
+Log files are read line by line from the offset saved by the previous run,
+so memory does not depend on the size of the logs. Offsets are saved per
+file identity (device and inode), so a file renamed by rotation is read
+from where it was left and a new file is read from the start. Request
+latency is kept in histograms with logarithmic buckets, percentiles are
+accurate to a few percent.
+"""
+import glob
+import math
+import os
+import re
+from collections import Counter, defaultdict
+
+LINE = re.compile(r'^(DEBUG|INFO|WARNING|ERROR|CRITICAL) (\d{4}-\d\d-\d\d \d\d:\d\d):\d\d,\d+ \S+ \S+ (.*)$')
+REQUEST = re.compile(r'^Запрос:: (\S+) (\S+) (\d{3}) ([\d.]+) мс$')
+EVENTS = {
+    'orders': re.compile(r'^Заказ #\d+ сформирован'),
+    'payments': re.compile(r'^Заказ #\d+ оплачен'),
+    'logins': re.compile(r'^Выполнен вход'),
+    'funds': re.compile(r'^Пользователь:: \S+\. Пополнение счета'),
+}
+# per minute counters older than that are dropped from the state
+MINUTES_KEPT = 60 * 24
+# ratio of neighbour bucket bounds
+HISTOGRAM_BASE = 2 ** (1 / 8)
+PERCENTILES = (50, 90, 99)
+READ_BUFFER_SIZE = 1024 * 1024
+
+
+class Histogram:
+    """Counts of values in logarithmic buckets."""
+
+    def __init__(self, buckets=None):
+        self.buckets = Counter({int(index): count for index, count in (buckets or {}).items()})
+
+    def add(self, value):
+        index = math.floor(math.log(value, HISTOGRAM_BASE)) if value > 0 else -1000
+        self.buckets[index] += 1
+
+    def count(self):
+        return sum(self.buckets.values())
+
+    def percentile(self, percent):
+        """Return upper bound of the bucket holding the percentile."""
+        total = self.count()
+        if not total:
+            return None
+        rank = math.ceil(total * percent / 100)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return HISTOGRAM_BASE ** (index + 1)
+        return None
+
+    def to_dict(self):
+        return {str(index): count for index, count in self.buckets.items()}
+
+
+class LogStats:
+    """Aggregates of log lines."""
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.levels = Counter(data.get('levels', {}))
+        self.events = Counter(data.get('events', {}))
+        self.endpoints = defaultdict(lambda: {'requests': 0, 'client_errors': 0, 'errors': 0,
+                                              'latency': Histogram()})
+        for name, endpoint in data.get('endpoints', {}).items():
+            self.endpoints[name] = dict(endpoint, latency=Histogram(endpoint['latency']))
+        self.minutes = defaultdict(Counter, {minute: Counter(counts)
+                                             for minute, counts in data.get('minutes', {}).items()})
+
+    def _count(self, minute, name):
+        if minute not in self.minutes and len(self.minutes) >= 2 * MINUTES_KEPT:
+            # a new minute, the oldest are dropped in batches to keep memory bounded
+            for old in sorted(self.minutes)[:-MINUTES_KEPT]:
+                del self.minutes[old]
+        self.minutes[minute][name] += 1
+
+    def feed(self, line):
+        """Add a line of the log, lines of tracebacks are skipped."""
+        match = LINE.match(line)
+        if match is None:
+            return
+        level, minute, message = match.groups()
+        self.levels[level] += 1
+        if level in ('ERROR', 'CRITICAL'):
+            self._count(minute, 'errors')
+        request = REQUEST.match(message)
+        if request is not None:
+            method, url_name, status, duration = request.groups()
+            endpoint = self.endpoints[url_name]
+            endpoint['requests'] += 1
+            if status >= '500':
+                endpoint['errors'] += 1
+            elif status >= '400':
+                endpoint['client_errors'] += 1
+            endpoint['latency'].add(float(duration))
+            self._count(minute, 'requests')
+            return
+        for event, pattern in EVENTS.items():
+            if pattern.match(message):
+                self.events[event] += 1
+                self._count(minute, event)
+                return
+
+    def to_dict(self):
+        minutes = sorted(self.minutes)[-MINUTES_KEPT:]
+        return {
+            'levels': dict(self.levels),
+            'events': dict(self.events),
+            'endpoints': {name: dict(endpoint, latency=endpoint['latency'].to_dict())
+                          for name, endpoint in self.endpoints.items()},
+            'minutes': {minute: dict(self.minutes[minute]) for minute in minutes},
+        }
+
+    def summary(self, last=60):
+        """Return report with percentiles of the endpoints and counters of the last minutes."""
+        endpoints = {}
+        for name, endpoint in sorted(self.endpoints.items()):
+            requests = endpoint['requests']
+            endpoints[name] = {
+                'requests': requests,
+                'error_rate': round(endpoint['errors'] / requests, 4) if requests else 0,
+                'client_error_rate': round(endpoint['client_errors'] / requests, 4) if requests else 0,
+            }
+            for percent in PERCENTILES:
+                value = endpoint['latency'].percentile(percent)
+                endpoints[name][f'p{percent}_ms'] = round(value, 1) if value is not None else None
+        minutes = {minute: dict(self.minutes[minute]) for minute in sorted(self.minutes)[-last:]}
+        return {'levels': dict(self.levels), 'events': dict(self.events),
+                'endpoints': endpoints, 'minutes': minutes}
+
+
+def log_files(path):
+    """Return the log file and its rotated copies, oldest first."""
+    paths = [name for name in glob.glob(f'{glob.escape(path)}.*') if name[len(path) + 1:].isdigit()]
+    if os.path.exists(path):
+        paths.append(path)
+    return sorted(paths, key=os.path.getmtime)
+
+
+def file_id(path):
+    stat = os.stat(path)
+    return f'{stat.st_dev}:{stat.st_ino}'
+
+
+def read_lines(path, offset):
+    """Yield complete lines of the file after offset and offset of the end of each line."""
+    with open(path, 'rb', buffering=READ_BUFFER_SIZE) as file:
+        file.seek(offset)
+        for line in file:
+            if not line.endswith(b'\n'):
+                # being written, will be read next time
+                return
+            offset += len(line)
+            yield line.decode('utf-8', errors='replace').rstrip('\r\n'), offset
+
+
+def analyze(paths, state):
+    """Read new lines of paths, return LogStats and the new state."""
+    stats = LogStats(state.get('stats'))
+    offsets = state.get('offsets', {})
+    new_offsets = {}
+    for path in paths:
+        identity = file_id(path)
+        offset = offsets.get(identity, 0)
+        if os.path.getsize(path) < offset:
+            # file was truncated
+            offset = 0
+        for line, offset in read_lines(path, offset):
+            stats.feed(line)
+        new_offsets[identity] = offset
+    # offsets of deleted files are forgotten
+    return stats, {'offsets': new_offsets, 'stats': stats.to_dict()}
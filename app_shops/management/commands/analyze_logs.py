@@ -0,0 +1,50 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app_shops.logstats import analyze, log_files
+
+
+class Command(BaseCommand):
+    help = 'Read new lines of the log and its rotated copies, print request latency and event counters.'
+
+    def add_arguments(self, parser):
+        default_path = settings.LOGGING['handlers']['file']['filename']
+        parser.add_argument('paths', nargs='*', help=f'log files, by default {default_path} and its rotated copies')
+        parser.add_argument('--state', default=f'{default_path}.state.json',
+                            help='file to keep offsets and counters between runs')
+        parser.add_argument('--reset', action='store_true', help='forget saved offsets and counters')
+        parser.add_argument('--last', type=int, default=60, help='number of minutes to show')
+        parser.add_argument('--json', action='store_true', help='print JSON')
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or log_files(settings.LOGGING['handlers']['file']['filename'])
+        state = {}
+        if not options['reset'] and os.path.exists(options['state']):
+            with open(options['state'], encoding='utf-8') as file:
+                state = json.load(file)
+        stats, state = analyze(paths, state)
+        with open(f'{options["state"]}.tmp', 'w', encoding='utf-8') as file:
+            json.dump(state, file)
+        os.replace(f'{options["state"]}.tmp', options['state'])
+
+        summary = stats.summary(options['last'])
+        if options['json']:
+            self.stdout.write(json.dumps(summary, ensure_ascii=False, indent=2))
+            return
+        self.stdout.write(f'{"endpoint":<24}{"requests":>10}{"p50 ms":>10}{"p90 ms":>10}{"p99 ms":>10}'
+                          f'{"4xx":>8}{"5xx":>8}')
+        for name, endpoint in summary['endpoints'].items():
+            self.stdout.write(f'{name:<24}{endpoint["requests"]:>10}{endpoint["p50_ms"]:>10}'
+                              f'{endpoint["p90_ms"]:>10}{endpoint["p99_ms"]:>10}'
+                              f'{endpoint["client_error_rate"]:>8.2%}{endpoint["error_rate"]:>8.2%}')
+        self.stdout.write('')
+        self.stdout.write(f'{"minute":<20}{"requests":>10}{"orders":>8}{"payments":>10}{"errors":>8}')
+        for minute, counts in summary['minutes'].items():
+            self.stdout.write(f'{minute:<20}{counts.get("requests", 0):>10}{counts.get("orders", 0):>8}'
+                              f'{counts.get("payments", 0):>10}{counts.get("errors", 0):>8}')
+        self.stdout.write('')
+        self.stdout.write('Events: ' + ', '.join(f'{name} {count}' for name, count in sorted(summary['events'].items())))
+        self.stdout.write('Levels: ' + ', '.join(f'{name} {count}' for name, count in sorted(summary['levels'].items())))
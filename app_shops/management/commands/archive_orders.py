@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app_shops.archive import archive_cutoff, archive_orders
+
+
+class Command(BaseCommand):
+    help = 'Move old bought orders with their items to archive tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ORDER_ARCHIVE_AFTER_DAYS,
+                            help='archive orders older than this number of days')
+        parser.add_argument('--batch-size', type=int, default=settings.ORDER_ARCHIVE_BATCH_SIZE,
+                            help='number of orders moved in one transaction')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='pause between batches, seconds')
+
+    def handle(self, *args, **options):
+        cutoff = archive_cutoff(options['days'])
+        archived = archive_orders(cutoff, options['batch_size'], options['pause'])
+        self.stdout.write(f'Archived orders: {archived}')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app_shops.recommendations import RELATED_ITEMS_STORED, build_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Rebuild frequently bought together recommendations from paid orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=RELATED_ITEMS_STORED,
+                            help='number of related items stored per item')
+        parser.add_argument('--chunk-size', type=int, default=100000,
+                            help='number of order lines read from database at once')
+
+    def handle(self, *args, **options):
+        try:
+            import numpy  # noqa: F401
+            import scipy  # noqa: F401
+        except ImportError:
+            raise CommandError('numpy and scipy are required to build recommendations')
+        stored = build_recommendations(options['top'], options['chunk_size'])
+        self.stdout.write(f'Stored related items: {stored}')
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from app_shops.storage import content_storage, referenced_names
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Delete stored files no file field refers to, left by deletes during the link grace period.'
+
+    def handle(self, *args, **options):
+        names = list(content_storage.stored_names())
+        deleted = 0
+        for start in range(0, len(names), BATCH_SIZE):
+            batch = names[start:start + BATCH_SIZE]
+            used = referenced_names(batch)
+            for name in batch:
+                if name not in used and content_storage.delete_unused(name):
+                    deleted += 1
+        self.stdout.write(f'Deleted files: {deleted}')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from app_shops.catalog import bump_version
+from app_shops.facets import bump_facets, set_shop_tags
+from app_shops.models import Shop
+
+
+class Command(BaseCommand):
+    help = 'Fill shop tags from Shop.tags, facets are counted again on the next request.'
+
+    def handle(self, *args, **options):
+        shops = 0
+        for shop in Shop.objects.all():
+            set_shop_tags(shop)
+            shops += 1
+        bump_version()
+        bump_facets()
+        self.stdout.write(f'Shops: {shops}')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app_shops.popularity import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = 'Recount sales counters of items from paid orders.'
+
+    def handle(self, *args, **options):
+        updated = rebuild_counters()
+        self.stdout.write(f'Items with sales: {updated}')
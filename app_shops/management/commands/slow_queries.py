@@ -0,0 +1,58 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app_shops.logstats import log_files
+
+ORDERINGS = {
+    'total': lambda query: query['total'],
+    'max': lambda query: query['max'],
+    'count': lambda query: query['count'],
+}
+
+
+class Command(BaseCommand):
+    help = 'Show query fingerprints of the slow query log with the most time spent.'
+
+    def add_arguments(self, parser):
+        default_path = settings.LOGGING['handlers']['slow_queries']['filename']
+        parser.add_argument('paths', nargs='*', help=f'log files, by default {default_path} and its rotated copies')
+        parser.add_argument('--order', choices=ORDERINGS, default='total', help='sort fingerprints by')
+        parser.add_argument('--limit', type=int, default=10, help='number of fingerprints to show')
+        parser.add_argument('--json', action='store_true', help='print JSON')
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or log_files(settings.LOGGING['handlers']['slow_queries']['filename'])
+        queries = {}
+        for path in paths:
+            with open(path, encoding='utf-8', errors='replace') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    query = queries.setdefault(record['fingerprint'], {
+                        'fingerprint': record['fingerprint'], 'statement': record['statement'],
+                        'count': 0, 'total': 0, 'max': 0, 'callers': {}, 'plan': None})
+                    query['count'] += 1
+                    query['total'] += record['duration']
+                    caller = record.get('caller') or 'unknown'
+                    query['callers'][caller] = query['callers'].get(caller, 0) + 1
+                    if record['duration'] >= query['max']:
+                        # plan of the slowest run
+                        query['max'] = record['duration']
+                        query['plan'] = record.get('plan')
+        top = sorted(queries.values(), key=ORDERINGS[options['order']], reverse=True)[:options['limit']]
+        if options['json']:
+            self.stdout.write(json.dumps(top, ensure_ascii=False, indent=2))
+            return
+        for query in top:
+            self.stdout.write(f'{query["fingerprint"]}  count {query["count"]}  total {query["total"]:.3f} s  '
+                              f'max {query["max"]:.3f} s')
+            self.stdout.write(f'    {query["statement"]}')
+            for caller, count in sorted(query['callers'].items(), key=lambda item: -item[1]):
+                self.stdout.write(f'    called from {caller} ({count})')
+            for row in query['plan'] or []:
+                self.stdout.write(f'    plan: {row}')
+            self.stdout.write('')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app_shops.models import Shop
+from app_shops.sync import new_sync_token
+
+
+class Command(BaseCommand):
+    help = 'Make a new token of the shop for the sync API, the old token stops working.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('shop_id', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            shop = Shop.objects.get(id=options['shop_id'])
+        except Shop.DoesNotExist:
+            raise CommandError(f'Shop {options["shop_id"]} does not exist')
+        self.stdout.write(new_sync_token(shop))
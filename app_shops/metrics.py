@@ -0,0 +1,362 @@
+"""Counters, gauges and histograms shared by worker processes.
+
+Every process keeps its values in its own memory mapped file in
+METRICS_DIR, so an update is a write to memory without locks between
+processes. /metrics reads the files of all processes, sums counters and
+histograms and shows gauges per process in Prometheus text format. Counters
+and histograms of finished processes are merged into aggregate.db and their
+files are deleted, so counters do not go back after a restart of a worker and
+gauges of dead processes are not shown.
+
+/metrics is open to METRICS_ALLOWED_IPS only for requests that did not come
+through a proxy (no X-Forwarded-For). Behind a reverse proxy set
+METRICS_TOKEN and send it as ``Authorization: Bearer <token>``.
+"""
+import hmac
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from app_shops.ratelimit import query_timer
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, files of finished processes are kept
+    fcntl = None
+
+METRICS_DIR = getattr(settings, 'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'djloggingprofiling-metrics'))
+METRICS_ALLOWED_IPS = getattr(settings, 'METRICS_ALLOWED_IPS', ['127.0.0.1'])
+METRICS_TOKEN = getattr(settings, 'METRICS_TOKEN', None)
+AGGREGATE_FILE = 'aggregate.db'
+LOCK_FILE = '.lock'
+# seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# used bytes of the file
+HEADER = struct.Struct('<Q')
+# record is length of the key, the key padded to 8 bytes and the value
+KEY_LENGTH = struct.Struct('<I')
+VALUE = struct.Struct('<d')
+INITIAL_SIZE = 64 * 1024
+
+
+def _padded(length):
+    return (length + 7) // 8 * 8
+
+
+class MmapValues:
+    """Values of one process, {key: float} stored in a memory mapped file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < INITIAL_SIZE:
+            os.ftruncate(self._fd, INITIAL_SIZE)
+        self._map = mmap.mmap(self._fd, os.fstat(self._fd).st_size)
+        self._positions = {}
+        used = HEADER.unpack_from(self._map, 0)[0] or HEADER.size
+        HEADER.pack_into(self._map, 0, used)
+        # values left by a finished process with the same pid are kept
+        for key, value, position in _read_records(self._map, used):
+            self._positions[key] = position
+
+    def _position(self, key):
+        position = self._positions.get(key)
+        if position is None:
+            encoded = key.encode()
+            used = HEADER.unpack_from(self._map, 0)[0]
+            size = _padded(KEY_LENGTH.size + len(encoded)) + VALUE.size
+            if used + size > len(self._map):
+                new_size = max(len(self._map) * 2, used + size)
+                self._map.close()
+                os.ftruncate(self._fd, new_size)
+                self._map = mmap.mmap(self._fd, new_size)
+            KEY_LENGTH.pack_into(self._map, used, len(encoded))
+            self._map[used + KEY_LENGTH.size:used + KEY_LENGTH.size + len(encoded)] = encoded
+            position = used + size - VALUE.size
+            VALUE.pack_into(self._map, position, 0)
+            # the record is complete before readers can see it
+            HEADER.pack_into(self._map, 0, used + size)
+            self._positions[key] = position
+        return position
+
+    def add(self, key, amount):
+        with self._lock:
+            position = self._position(key)
+            VALUE.pack_into(self._map, position, VALUE.unpack_from(self._map, position)[0] + amount)
+
+    def set(self, key, value):
+        with self._lock:
+            VALUE.pack_into(self._map, self._position(key), value)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+def _read_records(data, used):
+    offset = HEADER.size
+    while offset < used:
+        length = KEY_LENGTH.unpack_from(data, offset)[0]
+        key = bytes(data[offset + KEY_LENGTH.size:offset + KEY_LENGTH.size + length]).decode()
+        position = offset + _padded(KEY_LENGTH.size + length)
+        yield key, VALUE.unpack_from(data, position)[0], position
+        offset = position + VALUE.size
+
+
+def read_values(path):
+    """Return [(key, value)] of a file of any process."""
+    with open(path, 'rb') as file:
+        data = file.read()
+    if len(data) < HEADER.size:
+        return []
+    used = min(HEADER.unpack_from(data, 0)[0], len(data))
+    return [(key, value) for key, value, position in _read_records(data, used)]
+
+
+class _DirectoryLock:
+    """Lock of METRICS_DIR between processes, held while files are created or merged."""
+
+    def __enter__(self):
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        self._fd = os.open(os.path.join(METRICS_DIR, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o600)
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        # closing the file releases the lock
+        os.close(self._fd)
+
+
+_values = None
+_values_pid = None
+_values_lock = threading.Lock()
+
+
+def _process_values():
+    global _values, _values_pid
+    # every forked worker gets its own file
+    if _values_pid != os.getpid():
+        with _values_lock:
+            if _values_pid != os.getpid():
+                # not while the file of a finished process with the same pid is merged
+                with _DirectoryLock():
+                    _values = MmapValues(os.path.join(METRICS_DIR, f'{os.getpid()}.db'))
+                _values_pid = os.getpid()
+    return _values
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # process of another user
+        return True
+    return True
+
+
+def merge_finished():
+    """Add counters and histograms of finished processes to the aggregate file, delete their files."""
+    if fcntl is None or not os.path.isdir(METRICS_DIR):
+        return 0
+    merged = 0
+    with _DirectoryLock():
+        aggregate = None
+        for file_name in os.listdir(METRICS_DIR):
+            pid = file_name[:-3]
+            if not file_name.endswith('.db') or not pid.isdigit() or _is_running(int(pid)):
+                continue
+            path = os.path.join(METRICS_DIR, file_name)
+            if aggregate is None:
+                aggregate = MmapValues(os.path.join(METRICS_DIR, AGGREGATE_FILE))
+            for key, value in read_values(path):
+                metric = REGISTRY.get(json.loads(key)[0])
+                # gauges of a dead process mean nothing
+                if metric is not None and metric.kind != 'gauge' and value:
+                    aggregate.add(key, value)
+            os.remove(path)
+            merged += 1
+        if aggregate is not None:
+            aggregate.close()
+    return merged
+
+
+def _key(name, suffix, labels):
+    return json.dumps([name, suffix, sorted(labels.items())])
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY[name] = self
+
+    def _labels(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}')
+        return {name: str(value) for name, value in labels.items()}
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        _process_values().add(_key(self.name, '_total', self._labels(labels)), amount)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        _process_values().set(_key(self.name, '', self._labels(labels)), value)
+
+    def inc(self, amount=1, **labels):
+        _process_values().add(_key(self.name, '', self._labels(labels)), amount)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        labels = self._labels(labels)
+        values = _process_values()
+        # buckets are cumulative
+        for bound in self.buckets:
+            if value <= bound:
+                values.add(_key(self.name, '_bucket', dict(labels, le=str(bound))), 1)
+        values.add(_key(self.name, '_bucket', dict(labels, le='+Inf')), 1)
+        values.add(_key(self.name, '_sum', labels), value)
+        values.add(_key(self.name, '_count', labels), 1)
+
+
+REGISTRY = {}
+
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'Time of requests by url name.', ['view', 'method'])
+REQUESTS = Counter('http_requests', 'Requests by url name and status.', ['view', 'method', 'status'])
+DB_DURATION = Histogram('db_request_duration_seconds', 'Time of database queries of a request by url name.',
+                        ['view'])
+DB_QUERIES = Counter('db_queries', 'Database queries by url name.', ['view'])
+CACHE_REQUESTS = Counter('catalog_cache_requests', 'Lookups of cached promotions and offers lists.',
+                         ['list', 'result'])
+CHECKOUTS = Counter('checkouts', 'Cart actions: order placed or cart cleaned.', ['outcome'])
+PAYMENTS = Counter('payments', 'Payments of orders by outcome.', ['outcome'])
+CSV_IMPORT_ROWS = Counter('csv_import_rows', 'Rows of uploaded item files, rows after a failed one are skipped.',
+                          ['result'])
+PROCESS_START = Gauge('process_start_time_seconds', 'Start time of the worker process.')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels:
+        value = value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def collect():
+    """Return values of all processes, {(name, suffix, labels): value}."""
+    samples = {}
+    if not os.path.isdir(METRICS_DIR):
+        return samples
+    merge_finished()
+    for file_name in os.listdir(METRICS_DIR):
+        if not file_name.endswith('.db'):
+            continue
+        pid = file_name[:-3]
+        try:
+            values = read_values(os.path.join(METRICS_DIR, file_name))
+        except FileNotFoundError:
+            # merged by another process
+            continue
+        for key, value in values:
+            name, suffix, labels = json.loads(key)
+            metric = REGISTRY.get(name)
+            if metric is None:
+                continue
+            labels = tuple(tuple(label) for label in labels)
+            if metric.kind == 'gauge':
+                # gauges are not summed, every process has its own
+                labels = tuple(sorted(dict(labels, pid=pid).items()))
+                samples[(name, suffix, labels)] = value
+            else:
+                samples[(name, suffix, labels)] = samples.get((name, suffix, labels), 0) + value
+    return samples
+
+
+def render():
+    """Return metrics in Prometheus text format."""
+    by_name = {}
+    for (name, suffix, labels), value in collect().items():
+        by_name.setdefault(name, []).append((suffix, labels, value))
+    lines = []
+    for name, metric in REGISTRY.items():
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        for suffix, labels, value in sorted(by_name.get(name, []), key=_sample_order):
+            lines.append(f'{name}{suffix}{_format_labels(labels)} {value!r}')
+    return '\n'.join(lines) + '\n'
+
+
+def _sample_order(sample):
+    suffix, labels, value = sample
+    labels = dict(labels)
+    bound = labels.pop('le', None)
+    bound = float('inf') if bound == '+Inf' else float(bound or 0)
+    return sorted(labels.items()), suffix, bound
+
+
+def _allowed(request):
+    if METRICS_TOKEN:
+        scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+        return scheme.lower() == 'bearer' and hmac.compare_digest(token.strip(), METRICS_TOKEN)
+    # behind a proxy every request comes from its address
+    return 'HTTP_X_FORWARDED_FOR' not in request.META and \
+        request.META.get('REMOTE_ADDR') in METRICS_ALLOWED_IPS
+
+
+def metrics_view(request):
+    """Show metrics of all worker processes."""
+    if not _allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class MetricsMiddleware:
+    """Measure time of requests and of their database queries per url name."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        PROCESS_START.set(time.time())
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with query_timer(request) as timer:
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+        match = request.resolver_match
+        view = match.url_name if match is not None and match.url_name else 'unresolved'
+        REQUEST_DURATION.observe(duration, view=view, method=request.method)
+        REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        DB_DURATION.observe(timer.duration, view=view)
+        DB_QUERIES.inc(timer.count, view=view)
+        return response
@@ -2,13 +2,32 @@ from django.db import models
 from django.contrib.auth import get_user_model
 from django.utils.translation import gettext_lazy as _
 
+from app_shops.storage import content_storage
+
+
+class Tag(models.Model):
+    """Shop tag, filled from Shop.tags by signals."""
+    name = models.CharField(max_length=150, unique=True, verbose_name=_('название'))
+
+    class Meta:
+        verbose_name = _('тег')
+        verbose_name_plural = _('теги')
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
 
 class Shop(models.Model):
     seller = models.ForeignKey(get_user_model(), on_delete=models.CASCADE,
                                related_name="shops", verbose_name=_('продавец'))
     name = models.CharField(max_length=36, verbose_name=_('название'))
     tags = models.CharField(max_length=150, verbose_name=_('теги'))
+    tag_list = models.ManyToManyField(Tag, related_name='shops', blank=True, verbose_name=_('теги'))
     logo = models.ImageField(upload_to='files/', blank=True, verbose_name=_('логотип'))
+    # sha256 of the token of sync_items_api, set by sync_token command
+    sync_token = models.CharField(max_length=64, blank=True, editable=False, db_index=True,
+                                  verbose_name=_('токен синхронизации'))
 
     class Meta:
         verbose_name = _('магазин')
@@ -28,20 +47,40 @@ class Item(models.Model):
     amount = models.IntegerField(verbose_name=_('количество'), default=0)
     is_promotion = models.BooleanField(default=False, verbose_name=_('акция'))
     is_offer = models.BooleanField(default=False, verbose_name=_('специальное предложение'))
+    version = models.PositiveIntegerField(default=1, verbose_name=_('версия'))
+    # sales counters, see app_shops.popularity
+    sold_total = models.PositiveIntegerField(default=0, db_index=True, verbose_name=_('продано всего'))
+    sold_recent = models.FloatField(default=0, db_index=True, verbose_name=_('недавние продажи'))
 
     class Meta:
         verbose_name_plural = _('товары')
         verbose_name = _('товар')
         ordering = ['code']
+        # catalog filters and sorting
+        indexes = [models.Index(fields=['name']),
+                   models.Index(fields=['price']),
+                   models.Index(fields=['shop', 'price']),
+                   models.Index(fields=['is_promotion', 'price']),
+                   models.Index(fields=['is_offer', 'price'])]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """Increase version on every change of an existing item."""
+        if self.pk is not None:
+            self.version += 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'version'}
+        super().save(*args, **kwargs)
+
 
 class File(models.Model):
     item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='files',
                              verbose_name=_('товар'))
-    file = models.ImageField(upload_to='files/', verbose_name=_('файл'))
+    # same images share one stored file, see app_shops.storage
+    file = models.ImageField(upload_to='files/', storage=content_storage, db_index=True, verbose_name=_('файл'))
 
     class Meta:
         verbose_name = _('файл')
@@ -74,7 +113,7 @@ class Order(models.Model):
     STATUS_CHOICES = [
         ('b', _('куплено').capitalize()), ('o', _('оформлено').capitalize())
     ]
-    code = models.CharField(max_length=25, verbose_name=_('код заказа'))
+    code = models.CharField(max_length=25, verbose_name=_('код заказа'), db_index=True)
     created = models.DateTimeField(auto_now_add=True, verbose_name=_('дата создания'))
     status = models.CharField(max_length=1, verbose_name=_('статус заказа'),
                               choices=STATUS_CHOICES, default='o')
@@ -88,6 +127,9 @@ class Order(models.Model):
         verbose_name_plural = _('заказы')
         verbose_name = _('заказ')
         ordering = ['-created']
+        # to find old bought orders for archiving and to list orders in the admin
+        indexes = [models.Index(fields=['status', 'created']),
+                   models.Index(fields=['created'])]
 
 
 class OrderedItem(models.Model):
@@ -106,3 +148,60 @@ class OrderedItem(models.Model):
 
     def __str__(self):
         return str(self.item.id)
+
+
+class ArchivedOrder(models.Model):
+    """Bought order moved out of Order by archive_orders command."""
+    id = models.BigIntegerField(primary_key=True)
+    code = models.CharField(max_length=25, verbose_name=_('код заказа'), db_index=True)
+    created = models.DateTimeField(verbose_name=_('дата создания'), db_index=True)
+    status = models.CharField(max_length=1, verbose_name=_('статус заказа'),
+                              choices=Order.STATUS_CHOICES, default='b')
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE,
+                             related_name='archived_histories', verbose_name=_('покупатель'))
+
+    def __str__(self):
+        return self.code
+
+    class Meta:
+        verbose_name_plural = _('архивные заказы')
+        verbose_name = _('архивный заказ')
+        ordering = ['-created']
+
+
+class ArchivedOrderedItem(models.Model):
+    """Ordered item of an archived order."""
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE,
+                              related_name='ordered_items', verbose_name=_('номер заказа'))
+    item = models.ForeignKey(Item, on_delete=models.CASCADE,
+                             related_name='archived_ordered_items', verbose_name=_('товар'))
+    quantity = models.PositiveIntegerField(verbose_name=_('количество'), default=1)
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE,
+                             related_name='archived_ordered_items', verbose_name=_('покупатель'))
+    total_cost = models.DecimalField(max_digits=10, decimal_places=2, verbose_name=_('общая сумма'))
+
+    class Meta:
+        verbose_name_plural = _('архивные заказанные товары')
+        verbose_name = _('архивный заказанный товар')
+
+    def __str__(self):
+        return str(self.item_id)
+
+
+class RelatedItem(models.Model):
+    """Item bought together with another item and number of such orders."""
+    item = models.ForeignKey(Item, on_delete=models.CASCADE,
+                             related_name='related_items', verbose_name=_('товар'))
+    related = models.ForeignKey(Item, on_delete=models.CASCADE,
+                                related_name='+', verbose_name=_('связанный товар'))
+    count = models.PositiveIntegerField(verbose_name=_('количество заказов'), default=0)
+
+    class Meta:
+        verbose_name_plural = _('связанные товары')
+        verbose_name = _('связанный товар')
+        unique_together = [['item', 'related']]
+        indexes = [models.Index(fields=['item', '-count'])]
+
+    def __str__(self):
+        return f'{self.item_id} - {self.related_id}'
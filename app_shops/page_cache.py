@@ -0,0 +1,98 @@
+"""Full-page cache of catalog pages for anonymous users.
+
+Pages are stored per language, path and query string together with the
+catalog version they were rendered from, so a catalog write invalidates them
+without waiting for the timeout. While one request re-renders an outdated
+page, concurrent requests keep getting the previous copy instead of all
+hitting the database at once.
+"""
+import re
+import time
+from functools import wraps
+from hashlib import md5
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.translation import get_language
+
+from app_shops.catalog import get_version
+from app_shops.locks import lock
+
+PAGE_CACHE_TIMEOUT = getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 15)
+# how long an outdated page may be served while it is being re-rendered
+PAGE_CACHE_STALE_TIMEOUT = getattr(settings, 'PAGE_CACHE_STALE_TIMEOUT', 60 * 5)
+PAGE_CACHE_LOCK_TIMEOUT = 30
+
+CSRF_INPUT = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+CSRF_PLACEHOLDER = b'__csrf_token__'
+
+
+def _page_key(request):
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    url = f'{get_language()}:{request.path}?{query}'
+    return f'page:{md5(url.encode()).hexdigest()}'
+
+
+def _make_entry(response, version):
+    # CSRF token belongs to the visitor who rendered the page,
+    # so it is replaced on every hit.
+    content = CSRF_INPUT.sub(rb'\g<1>' + CSRF_PLACEHOLDER + rb'\g<2>', response.content)
+    return {'version': version,
+            'expires': time.time() + PAGE_CACHE_TIMEOUT,
+            'status': response.status_code,
+            'content_type': response['Content-Type'],
+            'content': content}
+
+
+def _response_from_entry(request, entry):
+    content = entry['content']
+    if CSRF_PLACEHOLDER in content:
+        content = content.replace(CSRF_PLACEHOLDER, get_token(request).encode())
+    return HttpResponse(content, status=entry['status'],
+                        content_type=entry['content_type'])
+
+
+def cache_anonymous_page(scope=None):
+    """Cache the page for anonymous GET requests.
+
+    ``scope`` selects the catalog version the page depends on:
+    None for the whole catalog, 'shop' or 'item' for the object
+    given by the ``pk`` view argument, or a function returning the
+    version for ``pk``.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+                return view_func(request, *args, **kwargs)
+
+            if scope is None:
+                version = get_version()
+            elif callable(scope):
+                version = scope(kwargs.get('pk'))
+            else:
+                version = get_version(scope, kwargs.get('pk'))
+            key = _page_key(request)
+            entry = cache.get(key)
+            if entry is not None and entry['version'] == version \
+                    and entry['expires'] > time.time():
+                return _response_from_entry(request, entry)
+
+            with lock(key, PAGE_CACHE_LOCK_TIMEOUT, blocking=False) as locked:
+                if not locked:
+                    # another request is rendering the page right now
+                    if entry is not None:
+                        return _response_from_entry(request, entry)
+                    return view_func(request, *args, **kwargs)
+                response = view_func(request, *args, **kwargs)
+                if callable(getattr(response, 'render', None)):
+                    response = response.render()
+                if response.status_code == 200 and not response.streaming:
+                    cache.set(key, _make_entry(response, version),
+                              PAGE_CACHE_TIMEOUT + PAGE_CACHE_STALE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,57 @@
+"""Paginator of large tables for the admin.
+
+COUNT(*) of a table with millions of rows reads the whole table. For a
+changelist without filters the number of rows is estimated from database
+statistics on PostgreSQL and MySQL, filtered lists, small tables and SQLite
+(which has no row estimate to rely on) are counted exactly. An estimate can
+be off both ways, so a page past the real end is shown empty instead of
+raising.
+"""
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+# tables with fewer rows are counted exactly
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+def estimate_count(model, using='default'):
+    """Return approximate number of rows of the table of model."""
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [table])
+            row = cursor.fetchone()
+        return int(row[0]) if row else None
+    if connection.vendor == 'mysql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT table_rows FROM information_schema.tables '
+                           'WHERE table_schema = DATABASE() AND table_name = %s', [table])
+            row = cursor.fetchone()
+        return int(row[0]) if row else None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator using an estimated number of rows for unfiltered large tables."""
+    estimated = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if getattr(queryset, 'query', None) is not None and not queryset.query.where:
+            estimate = estimate_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= ESTIMATED_COUNT_THRESHOLD:
+                self.estimated = True
+                return estimate
+        return super().count
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            # the table may have more rows than estimated, the page is shown even if empty
+            if self.count and self.estimated and int(number) >= 1:
+                return int(number)
+            raise
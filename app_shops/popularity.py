@@ -0,0 +1,76 @@
+"""Sales counters of items.
+
+Item.sold_total is the number of sold units. Item.sold_recent is the number
+of sold units with exponential time decay (half-life SALES_HALF_LIFE_DAYS)
+kept in forward form: every sale adds quantity * 2 ** (age of the sale
+since SALES_EPOCH / half-life). Old sales are never updated, but the order
+of items by sold_recent is the same as by the decayed number of sales at
+any moment, so both counters are plain indexed columns.
+
+The weights grow without limit, so sold_recent stores log2 of their sum,
+which grows by 52 a year instead of overflowing float. An item without
+sales (sold_total 0) has sold_recent 0.
+"""
+import math
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone as tz
+
+from app_shops.catalog import bump_version
+from app_shops.models import Item, OrderedItem, ArchivedOrderedItem
+
+SALES_EPOCH = datetime(2022, 1, 1, tzinfo=timezone.utc)
+SALES_HALF_LIFE_DAYS = getattr(settings, 'SALES_HALF_LIFE_DAYS', 7)
+
+SORT_ORDERS = {
+    'name': ['name'],
+    'popular': ['-sold_total', '-id'],
+    'recent': ['-sold_recent', '-id'],
+}
+
+
+def sales_weight(moment=None):
+    """Return log2 of weight of a sale made at the moment."""
+    if moment is None:
+        moment = tz.now()
+    return (moment - SALES_EPOCH).total_seconds() / (SALES_HALF_LIFE_DAYS * 24 * 60 * 60)
+
+
+def log2_add(first, second):
+    """Return log2(2 ** first + 2 ** second) without computing the powers."""
+    high, low = max(first, second), min(first, second)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def _add(total, recent, quantity, moment):
+    weight = math.log2(quantity) + sales_weight(moment)
+    return total + quantity, log2_add(recent, weight) if total else weight
+
+
+def add_sale(item, quantity, moment=None):
+    """Add sold quantity to counters of the item, it is saved by the caller."""
+    if quantity <= 0:
+        return
+    item.sold_total, item.sold_recent = _add(item.sold_total, item.sold_recent, quantity, moment)
+
+
+def rebuild_counters(chunk_size=10000):
+    """Recount sales counters of all items from paid orders including archive."""
+    counters = dict()
+    live = OrderedItem.objects.filter(order__status='b').values_list('item_id', 'quantity', 'order__created')
+    archived = ArchivedOrderedItem.objects.values_list('item_id', 'quantity', 'order__created')
+    for queryset in (live, archived):
+        for item_id, quantity, created in queryset.order_by().iterator(chunk_size=chunk_size):
+            if quantity > 0:
+                counters[item_id] = _add(*counters.get(item_id, (0, 0)), quantity, created)
+
+    items = [Item(id=item_id, sold_total=total, sold_recent=recent)
+             for item_id, (total, recent) in counters.items()]
+    with transaction.atomic():
+        Item.objects.update(sold_total=0, sold_recent=0)
+        Item.objects.bulk_update(items, ['sold_total', 'sold_recent'], batch_size=chunk_size)
+    # order of items on catalog pages is changed
+    bump_version()
+    return len(items)
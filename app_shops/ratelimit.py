@@ -0,0 +1,235 @@
+"""Rate limiting and load shedding of write requests.
+
+Every budget is a token bucket per user (or IP address for anonymous
+visitors, taken from X-Forwarded-For when the request comes from one of
+RATE_LIMIT_TRUSTED_PROXIES). Buckets are kept in a small memory mapped file, so all worker
+processes of the host share them without a round trip to the cache or the
+database. Slots of the file are locked with fcntl while they are changed.
+
+The first slot of the file keeps an exponential moving average of database
+query time measured by the middleware. While it is over the threshold, write
+requests of the sheddable budgets get 503 at once, checkout keeps working.
+"""
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from hashlib import blake2b
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, buckets are locked per process only
+    fcntl = None
+
+# budget: (tokens per second, bucket size)
+RATE_LIMITS = getattr(settings, 'RATE_LIMITS', {
+    'add_to_cart': (1, 20),
+    'auth': (0.1, 5),
+    'checkout': (0.5, 10),
+})
+# url name: budget, only POST requests are limited
+RATE_LIMIT_VIEWS = getattr(settings, 'RATE_LIMIT_VIEWS', {
+    'add_to_cart': 'add_to_cart',
+    'register': 'auth',
+    'login': 'auth',
+    'cart': 'checkout',
+    'order': 'checkout',
+})
+# budgets refused while the database is slow
+LOAD_SHEDDING_BUDGETS = getattr(settings, 'LOAD_SHEDDING_BUDGETS', {'add_to_cart', 'auth'})
+# average query time in seconds to start shedding load
+LOAD_SHEDDING_DB_LATENCY = getattr(settings, 'LOAD_SHEDDING_DB_LATENCY', 0.1)
+LOAD_SHEDDING_RETRY_AFTER = 5
+# weight of the last request in the moving average
+DB_LATENCY_ALPHA = 0.2
+# the average halves every that many seconds without requests
+DB_LATENCY_HALF_LIFE = 10
+
+# addresses of reverse proxies whose X-Forwarded-For is trusted
+RATE_LIMIT_TRUSTED_PROXIES = getattr(settings, 'RATE_LIMIT_TRUSTED_PROXIES', [])
+
+RATE_LIMIT_FILE = getattr(settings, 'RATE_LIMIT_FILE',
+                          os.path.join(tempfile.gettempdir(), 'djloggingprofiling-ratelimit'))
+RATE_LIMIT_SLOTS = getattr(settings, 'RATE_LIMIT_SLOTS', 4096)
+
+# key hash, tokens, time of the last update
+SLOT = struct.Struct('<Qdd')
+# average query time, time of the last update
+HEADER = struct.Struct('<dd')
+
+
+class SharedBuckets:
+    """Token buckets in a memory mapped file shared by worker processes.
+
+    Keys are hashed to slots, keys of one slot share its bucket. With
+    enough slots that only makes limits stricter for a few clients, a
+    spike of new keys can not empty the slots to get full buckets.
+    """
+
+    def __init__(self, path=RATE_LIMIT_FILE, slots=RATE_LIMIT_SLOTS):
+        self.path = path
+        self.slots = slots
+        self.size = SLOT.size * (slots + 1)
+        self._pid = None
+        self._fd = None
+        self._map = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        # the file is opened again in every forked worker
+        if self._pid == os.getpid():
+            return
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(fd).st_size < self.size:
+            os.ftruncate(fd, self.size)
+        self._fd = fd
+        self._map = mmap.mmap(fd, self.size)
+        self._pid = os.getpid()
+
+    def _locked(self, offset, func):
+        with self._lock:
+            self._open()
+            if fcntl is not None:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, SLOT.size, offset)
+            try:
+                return func()
+            finally:
+                if fcntl is not None:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN, SLOT.size, offset)
+
+    def take(self, key, rate, burst, now=None):
+        """Take a token from the bucket of key.
+
+        Return 0 if the request is allowed or seconds to wait otherwise.
+        """
+        now = time.time() if now is None else now
+        key_hash = int.from_bytes(blake2b(key.encode(), digest_size=8).digest(), 'little')
+        offset = SLOT.size * (1 + key_hash % self.slots)
+
+        def update():
+            # a slot never used has no tokens since the epoch, so it is full now
+            _, tokens, updated = SLOT.unpack_from(self._map, offset)
+            tokens = min(burst, tokens + max(now - updated, 0) * rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            SLOT.pack_into(self._map, offset, key_hash, tokens, now)
+            return wait
+
+        return self._locked(offset, update)
+
+    def db_latency(self, now=None):
+        """Return the average query time decayed by the time since the last update."""
+        now = time.time() if now is None else now
+
+        def read():
+            latency, updated = HEADER.unpack_from(self._map, 0)
+            return latency * 0.5 ** (max(now - updated, 0) / DB_LATENCY_HALF_LIFE)
+
+        return self._locked(0, read)
+
+    def add_db_latency(self, value, now=None):
+        """Add the average query time of a request to the moving average."""
+        now = time.time() if now is None else now
+
+        def update():
+            latency, updated = HEADER.unpack_from(self._map, 0)
+            latency *= 0.5 ** (max(now - updated, 0) / DB_LATENCY_HALF_LIFE)
+            latency += DB_LATENCY_ALPHA * (value - latency)
+            HEADER.pack_into(self._map, 0, latency, now)
+
+        self._locked(0, update)
+
+
+buckets = SharedBuckets()
+
+
+class QueryTimer:
+    """Execute wrapper summing time of the queries of a request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+@contextmanager
+def query_timer(request):
+    """Time queries of the request, middlewares asking again share the first timer."""
+    timer = getattr(request, '_query_timer', None)
+    if timer is not None:
+        yield timer
+        return
+    timer = request._query_timer = QueryTimer()
+    with connection.execute_wrapper(timer):
+        yield timer
+
+
+def client_address(request):
+    """Return IP address of the client, behind a trusted proxy the one it forwarded."""
+    address = request.META.get('REMOTE_ADDR', '')
+    if address not in RATE_LIMIT_TRUSTED_PROXIES:
+        return address
+    forwarded = [value.strip() for value in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')]
+    # every proxy appends the address it got the request from, the client can forge only the start
+    for address in reversed([value for value in forwarded if value]):
+        if address not in RATE_LIMIT_TRUSTED_PROXIES:
+            return address
+    return address
+
+
+def _too_many_requests(status, retry_after, message):
+    response = HttpResponse(message, status=status, content_type='text/plain')
+    response['Retry-After'] = str(max(math.ceil(retry_after), 1))
+    # refused requests are not written to the log one by one
+    response._has_been_logged = True
+    return response
+
+
+class RateLimitMiddleware:
+    """Limit write requests by budgets of RATE_LIMIT_VIEWS and shed load when the database is slow."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with query_timer(request) as timer:
+            response = self.get_response(request)
+        if timer.count:
+            buckets.add_db_latency(timer.duration / timer.count)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method != 'POST' or request.resolver_match is None:
+            return None
+        budget = RATE_LIMIT_VIEWS.get(request.resolver_match.url_name)
+        if budget is None:
+            return None
+        if budget in LOAD_SHEDDING_BUDGETS and buckets.db_latency() > LOAD_SHEDDING_DB_LATENCY:
+            return _too_many_requests(503, LOAD_SHEDDING_RETRY_AFTER, 'Service is overloaded, try again later.')
+        if request.user.is_authenticated:
+            client = f'user:{request.user.id}'
+        else:
+            client = f'ip:{client_address(request)}'
+        rate, burst = RATE_LIMITS[budget]
+        wait = buckets.take(f'{budget}:{client}', rate, burst)
+        if wait:
+            return _too_many_requests(429, wait, 'Too many requests, try again later.')
+        return None
@@ -0,0 +1,137 @@
+"""Frequently bought together recommendations.
+
+RelatedItem keeps, for every item, the items bought in the same paid orders
+and the number of such orders. The table is rebuilt from OrderedItem by
+build_recommendations command with sparse matrices (numpy and scipy are
+needed only there) and is updated incrementally when an order is paid.
+
+The item page shows cards of related items, so its version is made of the
+versions of the item and of the shown related items. Their ids are cached
+per item, dropped when an order with the item is paid and all at once by a
+full rebuild.
+"""
+from hashlib import md5
+from itertools import chain
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Sum
+
+from app_shops.cards import get_cards
+from app_shops.catalog import bump_version, get_version, get_versions, version_etag
+from app_shops.models import OrderedItem, ArchivedOrderedItem, RelatedItem
+
+# number of related items stored per item by full rebuild
+RELATED_ITEMS_STORED = 20
+# number of related items shown on pages
+RELATED_ITEMS_SHOWN = 5
+BULK_SIZE = 5000
+RELATED_IDS_TIMEOUT = 60 * 60 * 24
+
+
+def _order_lines(chunk_size):
+    """Pairs (order_id, item_id) of all paid orders including archive."""
+    live = OrderedItem.objects.filter(order__status='b').values_list('order_id', 'item_id').\
+        order_by().iterator(chunk_size=chunk_size)
+    archived = ArchivedOrderedItem.objects.values_list('order_id', 'item_id').\
+        order_by().iterator(chunk_size=chunk_size)
+    return chain(live, archived)
+
+
+def build_recommendations(top_n=RELATED_ITEMS_STORED, chunk_size=100000):
+    """Rebuild RelatedItem from all paid orders. Return number of stored rows."""
+    import numpy as np
+    from scipy import sparse
+
+    lines = np.fromiter(chain.from_iterable(_order_lines(chunk_size)), dtype=np.int64).reshape(-1, 2)
+    if not len(lines):
+        RelatedItem.objects.all().delete()
+        return 0
+    orders, order_index = np.unique(lines[:, 0], return_inverse=True)
+    items, item_index = np.unique(lines[:, 1], return_inverse=True)
+    # order x item matrix, 1 if item is in order
+    purchases = sparse.csr_matrix((np.ones(len(lines), dtype=np.int32), (order_index, item_index)),
+                                  shape=(len(orders), len(items)))
+    purchases.data[:] = 1
+    # item x item matrix, number of orders with both items
+    together = (purchases.T @ purchases).tocsr()
+    together.setdiag(0)
+    together.eliminate_zeros()
+
+    rows = []
+    for index in range(together.shape[0]):
+        start, end = together.indptr[index], together.indptr[index + 1]
+        columns = together.indices[start:end]
+        counts = together.data[start:end]
+        if len(counts) > top_n:
+            top = np.argpartition(-counts, top_n)[:top_n]
+            columns, counts = columns[top], counts[top]
+        item_id = int(items[index])
+        rows.extend(RelatedItem(item_id=item_id, related_id=int(items[column]), count=int(count))
+                    for column, count in zip(columns, counts))
+
+    with transaction.atomic():
+        RelatedItem.objects.all().delete()
+        RelatedItem.objects.bulk_create(rows, batch_size=BULK_SIZE)
+    # cached related ids of all items are outdated
+    bump_version('related', 'all')
+    return len(rows)
+
+
+def record_order(order_id):
+    """Add items of a paid order to RelatedItem."""
+    item_ids = set(OrderedItem.objects.filter(order_id=order_id).values_list('item_id', flat=True))
+    if len(item_ids) < 2:
+        return
+    pairs = RelatedItem.objects.filter(item_id__in=item_ids, related_id__in=item_ids)
+    existing = set(pairs.values_list('item_id', 'related_id'))
+    pairs.update(count=F('count') + 1)
+    RelatedItem.objects.bulk_create(
+        [RelatedItem(item_id=item_id, related_id=related_id, count=1)
+         for item_id in item_ids for related_id in item_ids
+         if item_id != related_id and (item_id, related_id) not in existing],
+        ignore_conflicts=True)
+    keys = [_related_ids_key(item_id) for item_id in item_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _related_ids_key(item_id):
+    return f'related_ids:{get_version("related", "all")}:{item_id}'
+
+
+def related_item_ids(item_id, number=RELATED_ITEMS_SHOWN):
+    """Return ids of items most often bought together with the item."""
+    key = _related_ids_key(item_id)
+    related_ids = cache.get(key)
+    if related_ids is None:
+        related_ids = list(RelatedItem.objects.filter(item_id=item_id).order_by('-count').
+                           values_list('related_id', flat=True)[:RELATED_ITEMS_SHOWN])
+        cache.set(key, related_ids, RELATED_IDS_TIMEOUT)
+    return related_ids[:number]
+
+
+def item_page_version(pk):
+    """Version of the item page: versions of the item and of its related items."""
+    item_ids = [pk] + related_item_ids(pk)
+    versions = get_versions('item', item_ids)
+    joined = ','.join(f'{item_id}:{versions[item_id]}' for item_id in item_ids)
+    return md5(joined.encode()).hexdigest()
+
+
+def item_etag(request, pk, *args, **kwargs):
+    """ETag of the item page."""
+    return version_etag(request, item_page_version(pk))
+
+
+def get_related_cards(item_ids, number=RELATED_ITEMS_SHOWN):
+    """Return cards of items most often bought together with the given items."""
+    item_ids = list(item_ids)
+    if not item_ids:
+        return []
+    if len(item_ids) == 1:
+        related_ids = related_item_ids(item_ids[0], number)
+    else:
+        related_ids = RelatedItem.objects.filter(item_id__in=item_ids).exclude(related_id__in=item_ids).\
+            values('related_id').annotate(score=Sum('count')).order_by('-score').\
+            values_list('related_id', flat=True)[:number]
+    return get_cards(related_ids)
@@ -0,0 +1,25 @@
+"""Log method, url name, status and duration of every request.
+
+Lines are read by analyze_logs command together with order and payment
+events of the views.
+"""
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RequestLogMiddleware:
+    """Write a line per request to the log."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        duration = (time.perf_counter() - start) * 1000
+        match = request.resolver_match
+        url_name = match.url_name if match is not None and match.url_name else 'unresolved'
+        logger.info(f'Запрос:: {request.method} {url_name} {response.status_code} {duration:.1f} мс')
+        return response
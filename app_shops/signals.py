@@ -0,0 +1,70 @@
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from app_shops.cards import invalidate_cards
+from app_shops.cart import flush_cart
+from app_shops.catalog import bump_catalog
+from app_shops.facets import FACET_FIELDS, bump_facets, changes_facets, set_shop_tags
+from app_shops.models import Shop, Item, File
+
+
+@receiver(pre_save, sender=Item)
+def remember_item_facets(sender, instance, raw=False, **kwargs):
+    """Remember the shop and other facet fields of the item before saving."""
+    instance._previous_facets = None
+    if instance.pk and not raw:
+        instance._previous_facets = Item.objects.filter(pk=instance.pk).values(*FACET_FIELDS).first()
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def item_changed(sender, instance, **kwargs):
+    bump_catalog(shop_id=instance.shop_id, item_id=instance.pk)
+    invalidate_cards([instance.pk])
+    previous = getattr(instance, '_previous_facets', None)
+    if previous is None or kwargs['signal'] is post_delete or \
+            changes_facets(previous, {name: getattr(instance, name) for name in FACET_FIELDS}):
+        bump_facets()
+    if previous is not None and previous['shop_id'] != instance.shop_id:
+        bump_catalog(shop_id=previous['shop_id'])
+
+
+@receiver(post_save, sender=File)
+@receiver(post_delete, sender=File)
+def file_changed(sender, instance, **kwargs):
+    shop_id = Item.objects.filter(pk=instance.item_id).values_list('shop_id', flat=True).first()
+    bump_catalog(shop_id=shop_id, item_id=instance.item_id)
+    invalidate_cards([instance.item_id])
+
+
+@receiver(post_delete, sender=File)
+def delete_unused_image(sender, instance, **kwargs):
+    # the storage keeps the image while other File rows refer to it
+    if instance.file:
+        instance.file.delete(save=False)
+
+
+@receiver(post_save, sender=Shop)
+@receiver(post_delete, sender=Shop)
+def shop_changed(sender, instance, **kwargs):
+    if kwargs['signal'] is post_save:
+        # before the version is bumped, so facets are counted with new tags
+        set_shop_tags(instance)
+    bump_catalog(shop_id=instance.pk)
+    bump_facets()
+    invalidate_cards(Item.objects.filter(shop_id=instance.pk).values_list('id', flat=True))
+
+
+@receiver(user_logged_in)
+def merge_cart(sender, request, user, **kwargs):
+    """Move items added to cart before login to the cart of the user."""
+    if request is not None and hasattr(request, 'session'):
+        flush_cart(request, user)
+
+
+@receiver(user_logged_out)
+def save_cart(sender, request, user, **kwargs):
+    """Write the buffer to Cart before logout flushes the session."""
+    if request is not None and hasattr(request, 'session') and user is not None:
+        flush_cart(request, user)
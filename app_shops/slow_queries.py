@@ -0,0 +1,106 @@
+"""Log of slow database queries.
+
+An execute wrapper added to every database connection measures queries
+and keeps those slower than SLOW_QUERY_THRESHOLD in a ring buffer of the
+process and writes them as JSON lines to the 'app_shops.slow_queries'
+logger. The record has the fingerprint of the statement, the function of
+the project that ran it and the query plan. slow_queries command shows the
+worst fingerprints.
+"""
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from hashlib import md5
+
+from django.conf import settings
+from django.utils import timezone as tz
+
+logger = logging.getLogger(__name__)
+
+# seconds
+SLOW_QUERY_THRESHOLD = getattr(settings, 'SLOW_QUERY_THRESHOLD', 0.1)
+SLOW_QUERY_BUFFER_SIZE = getattr(settings, 'SLOW_QUERY_BUFFER_SIZE', 200)
+
+NUMBER = re.compile(r'\b\d+(\.\d+)?\b')
+STRING = re.compile(r"'(?:[^']|'')*'")
+PLACEHOLDERS = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+SPACES = re.compile(r'\s+')
+
+PROJECT_DIR = str(settings.BASE_DIR)
+THIS_FILE = os.path.abspath(__file__)
+
+# the last slow queries of this process
+recent_queries = deque(maxlen=SLOW_QUERY_BUFFER_SIZE)
+_local = threading.local()
+
+
+def fingerprint(sql):
+    """Return statement with literals and lists of parameters replaced and its short hash."""
+    normalized = STRING.sub('?', sql)
+    normalized = NUMBER.sub('?', normalized)
+    normalized = PLACEHOLDERS.sub('(...)', normalized.replace('%s', '?'))
+    normalized = SPACES.sub(' ', normalized).strip()
+    return md5(normalized.encode()).hexdigest()[:12], normalized
+
+
+def _caller():
+    """Return the innermost function of the project outside of this module."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.startswith(PROJECT_DIR) and filename != THIS_FILE and 'site-packages' not in filename:
+            module = os.path.relpath(filename, PROJECT_DIR)
+            return f'{module}:{frame.f_code.co_name}:{frame.f_lineno}'
+        frame = frame.f_back
+    return None
+
+
+def _explain(connection, sql, params):
+    if connection.vendor == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif connection.vendor in ('postgresql', 'mysql'):
+        prefix = 'EXPLAIN '
+    else:
+        return None
+    _local.explaining = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+    except Exception as e:
+        return [f'EXPLAIN failed: {e}']
+    finally:
+        _local.explaining = False
+
+
+def slow_query_logger(execute, sql, params, many, context):
+    """Execute wrapper writing queries slower than SLOW_QUERY_THRESHOLD to the log."""
+    if getattr(_local, 'explaining', False):
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    result = execute(sql, params, many, context)
+    duration = time.perf_counter() - start
+    if duration >= SLOW_QUERY_THRESHOLD:
+        query_hash, normalized = fingerprint(sql)
+        plan = None
+        if not many and sql.lstrip()[:6].upper() == 'SELECT':
+            plan = _explain(context['connection'], sql, params)
+        record = {'time': tz.now().isoformat(), 'duration': round(duration, 6),
+                  'fingerprint': query_hash, 'statement': normalized, 'sql': sql,
+                  'caller': _caller(), 'plan': plan}
+        recent_queries.append(record)
+        logger.warning(json.dumps(record, ensure_ascii=False))
+    return result
+
+
+def install(sender=None, connection=None, **kwargs):
+    """Add the wrapper to a connection, receiver of connection_created."""
+    if slow_query_logger not in connection.execute_wrappers:
+        # connection.execute_wrapper() pops the last wrapper on exit, the connection
+        # may be opened inside of such a block, so this one goes first
+        connection.execute_wrappers.insert(0, slow_query_logger)
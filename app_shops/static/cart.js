@@ -0,0 +1,37 @@
+// Add items to cart without reloading the page.
+document.addEventListener('submit', function (event) {
+    var form = event.target;
+    if (!form.classList.contains('add-to-cart') || !window.fetch) {
+        return;
+    }
+    event.preventDefault();
+    var data = new FormData(form);
+    if (event.submitter && event.submitter.name) {
+        data.append(event.submitter.name, event.submitter.value);
+    }
+    fetch(form.action, {
+        method: 'POST',
+        body: data,
+        credentials: 'same-origin',
+        headers: {'X-Requested-With': 'XMLHttpRequest'}
+    }).then(function (response) {
+        if (response.status === 429 || response.status === 503) {
+            // refused by rate limiting, the answer is plain text
+            return response.text().then(function (text) {
+                return {error: text};
+            });
+        }
+        return response.json();
+    }).then(function (result) {
+        var status = document.getElementById('cart-status');
+        if (!result || !status) {
+            return;
+        }
+        if (result.error) {
+            status.textContent = result.error;
+        } else {
+            status.textContent = status.dataset.lines + ': ' + result.lines + ', ' +
+                status.dataset.total + ' ' + result.total_cost + ' ₽';
+        }
+    });
+});
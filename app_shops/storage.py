@@ -0,0 +1,134 @@
+"""Storage of item images named by their content.
+
+An upload is written to a temporary file chunk by chunk while its sha256 is
+computed, then moved to files/<first two hex digits>/<hash><extension>. An
+image uploaded again is not written, the new File row points to the stored
+one. A stored image is deleted only when no File row refers to it.
+
+An upload linked to a stored image commits its File row after _save, so a
+delete could see no rows and remove the image the new row is about to
+refer to. Linking and deleting take a lock file of the storage, linking
+touches the image, and an image touched less than FILE_LINK_GRACE seconds
+ago is not deleted. Such images are removed later by delete_unused_files
+command.
+
+Shop logos and avatars are uploaded to the same directory by the default
+storage, so a file is unused only if no file field of any model refers to it.
+"""
+import hashlib
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import FileField
+from django.utils.deconstruct import deconstructible
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, only the grace period protects linked images
+    fcntl = None
+
+# seconds, longer than a request saving an upload
+FILE_LINK_GRACE = getattr(settings, 'FILE_LINK_GRACE', 60 * 10)
+LOCK_FILE = '.storage.lock'
+
+
+def referenced_names(names):
+    """Return those of names a file field of any model refers to."""
+    names = list(names)
+    used = set()
+    for model in apps.get_models():
+        for field in model._meta.concrete_fields:
+            if isinstance(field, FileField):
+                used.update(model._base_manager.filter(**{f'{field.name}__in': names}).
+                            values_list(field.name, flat=True))
+    return used
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage keeping one copy of every distinct file."""
+
+    def __init__(self, prefix='files', **kwargs):
+        super().__init__(**kwargs)
+        self.prefix = prefix
+
+    def get_available_name(self, name, max_length=None):
+        # the name is chosen by content in _save
+        return name
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.location, exist_ok=True)
+        descriptor = os.open(os.path.join(self.location, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if fcntl is not None:
+                fcntl.flock(descriptor, fcntl.LOCK_EX)
+            yield
+        finally:
+            # closing the file releases the lock
+            os.close(descriptor)
+
+    def _save(self, name, content):
+        os.makedirs(self.location, exist_ok=True)
+        digest = hashlib.sha256()
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.location, prefix='.upload-')
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    file.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temporary_path, self.file_permissions_mode)
+            extension = os.path.splitext(name)[1].lower()
+            hexdigest = digest.hexdigest()
+            name = f'{self.prefix}/{hexdigest[:2]}/{hexdigest}{extension}'
+            path = self.path(name)
+            with self._locked():
+                if os.path.exists(path):
+                    # linked again, keep it from a delete until the File row is committed
+                    os.utime(path)
+                    os.remove(temporary_path)
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    # the same content uploaded at the same time gives the same file
+                    os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        return name.replace('\\', '/')
+
+    def delete(self, name):
+        """Delete the file after commit if no File refers to it."""
+        transaction.on_commit(lambda: self.delete_unused(name))
+
+    def delete_unused(self, name):
+        """Delete the file if nothing refers to it and it was not linked recently, return True if deleted."""
+        with self._locked():
+            if referenced_names([name]):
+                return False
+            try:
+                if time.time() - os.path.getmtime(self.path(name)) < FILE_LINK_GRACE:
+                    return False
+            except FileNotFoundError:
+                return False
+            super().delete(name)
+        return True
+
+    def stored_names(self):
+        """Yield names of all stored files."""
+        root = self.path(self.prefix)
+        for directory, _, file_names in os.walk(root):
+            for file_name in file_names:
+                if not file_name.startswith('.'):
+                    path = os.path.join(directory, file_name)
+                    yield os.path.relpath(path, self.location).replace('\\', '/')
+
+
+content_storage = ContentAddressedStorage()
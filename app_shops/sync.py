@@ -0,0 +1,181 @@
+"""Delta synchronization of item prices and stock.
+
+Sellers post only changed fields of items keyed by code::
+
+    {"items": [{"code": 100001, "version": 3, "price": "10.50", "amount": 7}]}
+
+If version is given, the item is updated only when it still has this
+version, otherwise the change is reported as a conflict with the current
+version. Changes are applied in chunks with one select and one bulk update
+per chunk, so the cost depends on the number of changes, not on the shop size.
+
+Two endpoints accept the same data. sync_items is for the seller logged in
+to the site and needs the session cookie and the CSRF token as any other
+form. sync_items_api is for programs (ERP) and needs no session: the
+request carries the token of the shop made by ``manage.py sync_token``::
+
+    curl -X POST -H 'Authorization: Token <token>' -H 'Content-Type: application/json' \
+         -d @changes.json https://<host>/shops/api/shops/<pk>/sync/
+
+Only sha256 of the token is stored, a new token replaces the old one.
+"""
+import hashlib
+import hmac
+import json
+import secrets
+
+from django.contrib.auth.decorators import login_required, permission_required
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import transaction
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from app_shops.cards import invalidate_cards
+from app_shops.catalog import bump_catalog, bump_version
+from app_shops.facets import bump_facets, changes_facets
+from app_shops.models import Shop, Item
+
+SYNC_FIELDS = ('name', 'description', 'price', 'amount', 'is_promotion', 'is_offer')
+SYNC_CHUNK_SIZE = 500
+SYNC_MAX_ITEMS = 10000
+
+
+def _clean_change(change):
+    """Return code, expected version and cleaned values of one change."""
+    if not isinstance(change, dict):
+        raise ValidationError('change must be an object')
+    errors = dict()
+    try:
+        code = int(change.get('code'))
+    except (TypeError, ValueError):
+        raise ValidationError('invalid code')
+    version = change.get('version')
+    if version is not None and (not isinstance(version, int) or isinstance(version, bool)):
+        errors['version'] = ['invalid version']
+    values = dict()
+    for name in SYNC_FIELDS:
+        if name in change:
+            try:
+                values[name] = Item._meta.get_field(name).clean(change[name], None)
+            except ValidationError as e:
+                errors[name] = e.messages
+    unknown = set(change) - set(SYNC_FIELDS) - {'code', 'version'}
+    for name in unknown:
+        errors[name] = ['unknown field']
+    if errors:
+        raise ValidationError(errors)
+    return code, version, values
+
+
+def apply_changes(shop_id, changes):
+    """Apply changes to items of the shop, return report of updates, conflicts and errors."""
+    report = {'updated': [], 'conflicts': [], 'errors': []}
+    cleaned = dict()
+    for change in changes:
+        try:
+            code, version, values = _clean_change(change)
+        except ValidationError as e:
+            code = change.get('code') if isinstance(change, dict) else None
+            errors = e.message_dict if hasattr(e, 'error_dict') else {'code': e.messages}
+            report['errors'].append({'code': code, 'errors': errors})
+            continue
+        if code in cleaned:
+            report['errors'].append({'code': code, 'errors': {'code': ['duplicate code']}})
+            continue
+        cleaned[code] = (version, values)
+
+    codes = list(cleaned)
+    updated_ids = []
+    facets_changed = False
+    for start in range(0, len(codes), SYNC_CHUNK_SIZE):
+        chunk = codes[start:start + SYNC_CHUNK_SIZE]
+        fields = sorted(set().union(*[cleaned[code][1] for code in chunk]))
+        with transaction.atomic():
+            items = Item.objects.select_for_update().filter(shop_id=shop_id, code__in=chunk).\
+                only('id', 'code', 'version', *fields)
+            found = {item.code: item for item in items}
+            changed = []
+            for code in chunk:
+                version, values = cleaned[code]
+                item = found.get(code)
+                if item is None:
+                    report['conflicts'].append({'code': code, 'reason': 'not_found'})
+                elif version is not None and item.version != version:
+                    report['conflicts'].append({'code': code, 'reason': 'version',
+                                                'version': item.version})
+                else:
+                    facets_changed = facets_changed or \
+                        changes_facets({name: getattr(item, name) for name in values}, values)
+                    for name, value in values.items():
+                        setattr(item, name, value)
+                    item.version += 1
+                    changed.append(item)
+            Item.objects.bulk_update(changed, fields + ['version'])
+        for item in changed:
+            report['updated'].append({'code': item.code, 'version': item.version})
+            updated_ids.append(item.id)
+
+    if updated_ids:
+        bump_catalog(shop_id=shop_id)
+
+        def bump_items():
+            for item_id in updated_ids:
+                bump_version('item', item_id)
+
+        transaction.on_commit(bump_items)
+        invalidate_cards(updated_ids)
+    if facets_changed:
+        bump_facets()
+    return report
+
+
+def token_hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def new_sync_token(shop):
+    """Set a new sync token of the shop and return it."""
+    token = secrets.token_urlsafe(32)
+    shop.sync_token = token_hash(token)
+    shop.save(update_fields=['sync_token'])
+    return token
+
+
+def _sync_response(request, shop):
+    try:
+        changes = json.loads(request.body)['items']
+        if not isinstance(changes, list):
+            raise TypeError
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'invalid data'}, status=400)
+    if len(changes) > SYNC_MAX_ITEMS:
+        return JsonResponse({'error': f'too many items, max {SYNC_MAX_ITEMS}'}, status=400)
+    return JsonResponse(apply_changes(shop.id, changes))
+
+
+@login_required
+@permission_required(['app_shops.change_shop', 'app_shops.change_item'], raise_exception=True)
+@require_POST
+def sync_items(request, pk):
+    """Update changed fields of shop items from JSON."""
+    shop = get_object_or_404(Shop, id=pk)
+    if shop.seller_id != request.user.id:
+        raise PermissionDenied
+    return _sync_response(request, shop)
+
+
+@csrf_exempt
+@require_POST
+def sync_items_api(request, pk):
+    """Update changed fields of shop items from JSON, authenticated by the sync token of the shop."""
+    scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    shop = Shop.objects.filter(id=pk).only('id', 'sync_token').first()
+    # the same answer for an unknown shop and a wrong token
+    if scheme.lower() != 'token' or not token or shop is None or not shop.sync_token or \
+            not hmac.compare_digest(shop.sync_token, token_hash(token.strip())):
+        response = JsonResponse({'error': 'invalid token'}, status=401)
+        response['WWW-Authenticate'] = 'Token'
+        return response
+    return _sync_response(request, shop)
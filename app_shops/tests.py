@@ -1,3 +1,505 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User, Permission
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.paginator import EmptyPage
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone as tz
+
+from app_shops import locks, ratelimit
+from app_shops.archive import archive_cutoff, archive_orders
+from app_shops.cart import CART_BUFFER_KEY
+from app_shops.cards import get_cards
+from app_shops.catalog import bump_version, get_version
+from app_shops.facets import compute_facet_counts, get_facets
+from app_shops.models import Shop, Item, File, Cart, Order, OrderedItem, ArchivedOrder, ArchivedOrderedItem
+from app_shops.paginators import EstimatedCountPaginator, estimate_count
+from app_shops.storage import content_storage
+from app_shops.sync import new_sync_token
+from app_users.models import Profile
+
+PASSWORD = 'pw12345!x'
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'},
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ShopTestCase(TestCase):
+    """Shop of a seller with items and a buyer, the cache is emptied, rate limits are off, metrics go to a tempdir."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user('seller', password=PASSWORD)
+        cls.seller.user_permissions.add(*Permission.objects.filter(codename__in=['change_shop', 'change_item']))
+        cls.buyer = User.objects.create_user('buyer', password=PASSWORD)
+        Profile.objects.bulk_create([Profile(user=cls.seller), Profile(user=cls.buyer, funds=1000)])
+        cls.shop = Shop.objects.create(seller=cls.seller, name='shop', tags='wine')
+        cls.items = [Item.objects.create(shop=cls.shop, code=1000 + index, name=f'item{index}',
+                                         description='description', price=10 + index, amount=5)
+                     for index in range(4)]
+
+    def setUp(self):
+        cache.clear()
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir, ignore_errors=True)
+        for patcher in (mock.patch('app_shops.metrics.METRICS_DIR', metrics_dir),
+                        mock.patch.dict('app_shops.ratelimit.RATE_LIMIT_VIEWS', clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def add(self, item, **extra):
+        return self.client.post(reverse('add_to_cart'), {'add': item.id}, **extra)
+
+    def cart(self, user):
+        return dict(Cart.objects.filter(user=user).values_list('item_id', 'quantity'))
+
+
+class CatalogVersionTest(ShopTestCase):
+
+    def test_versions_are_bumped_after_commit(self):
+        item = self.items[0]
+        versions = get_version(), get_version('shop', self.shop.id), get_version('item', item.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            item.price = 99
+            item.save()
+            self.assertEqual((get_version(), get_version('shop', self.shop.id), get_version('item', item.id)),
+                             versions)
+        self.assertGreater(get_version(), versions[0])
+        self.assertGreater(get_version('shop', self.shop.id), versions[1])
+        self.assertGreater(get_version('item', item.id), versions[2])
+
+
+class ItemCardTest(ShopTestCase):
+
+    def test_cards_are_dropped_after_commit(self):
+        item = self.items[0]
+        self.assertEqual(get_cards([item.id])[0]['item_price'], item.price)
+        with self.captureOnCommitCallbacks(execute=True):
+            item.price = 99
+            item.save()
+            self.assertEqual(cache.get(f'item_card:{item.id}')['item_price'], 10)
+        self.assertIsNone(cache.get(f'item_card:{item.id}'))
+        self.assertEqual(get_cards([item.id])[0]['item_price'], 99)
+
+
+class LockTest(ShopTestCase):
+
+    def assert_exclusive(self):
+        with locks.lock('name', 5) as locked:
+            self.assertTrue(locked)
+            with locks.lock('name', 5, blocking=False) as other:
+                self.assertFalse(other)
+        with locks.lock('name', 5, blocking=False) as locked:
+            self.assertTrue(locked)
+
+    def test_cache_lock(self):
+        self.assert_exclusive()
+
+    def test_file_lock(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        file_cache = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                  'LOCATION': os.path.join(directory, 'cache')}}
+        with override_settings(CACHES=file_cache), \
+                mock.patch('app_shops.locks.LOCKS_DIR', os.path.join(directory, 'locks')):
+            self.assert_exclusive()
+            self.assertEqual(os.listdir(os.path.join(directory, 'cache')), [])
+
+
+class PageCacheTest(ShopTestCase):
+
+    def test_page_is_rendered_again_after_bump(self):
+        self.assertContains(self.client.get(reverse('shop_list')), 'shop')
+        Shop.objects.update(name='renamed')
+        self.assertNotContains(self.client.get(reverse('shop_list')), 'renamed')
+        bump_version()
+        self.assertContains(self.client.get(reverse('shop_list')), 'renamed')
+
+    def test_outdated_page_is_served_while_locked(self):
+        with mock.patch('app_shops.page_cache._page_key', return_value='page:test'):
+            self.client.get(reverse('shop_list'))
+            Shop.objects.update(name='renamed')
+            bump_version()
+            with locks.lock('page:test', 30):
+                self.assertNotContains(self.client.get(reverse('shop_list')), 'renamed')
+            self.assertContains(self.client.get(reverse('shop_list')), 'renamed')
+
+    def test_authenticated_pages_are_not_cached(self):
+        self.client.login(username='buyer', password=PASSWORD)
+        self.client.get(reverse('shop_list'))
+        Shop.objects.update(name='renamed')
+        self.assertContains(self.client.get(reverse('shop_list')), 'renamed')
+
+
+class FacetTest(ShopTestCase):
+
+    def pay(self, item, quantity):
+        order = Order.objects.create(user=self.buyer, code=f'facets-{item.id}-{quantity}')
+        OrderedItem.objects.create(order=order, item=item, user=self.buyer, quantity=quantity,
+                                   total_cost=item.price * quantity)
+        self.client.login(username='buyer', password=PASSWORD)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(reverse('order', args=[order.code])).status_code, 200)
+
+    def test_counts_respect_the_filter(self):
+        Item.objects.filter(id=self.items[0].id).update(is_promotion=True)
+        facets = get_facets({'promotion': True})
+        self.assertEqual(facets['promotion'], 1)
+        self.assertEqual(facets['in_stock'], 1)
+        self.assertEqual([facet['count'] for facet in facets['shops']], [1])
+        self.assertEqual([facet['count'] for facet in facets['tags']], [1])
+        # counts of a group ignore the choice of the group itself
+        self.assertEqual(get_facets({'shop': self.shop.id + 1})['shops'][0]['count'], 4)
+
+    def test_sale_keeps_counts_until_sold_out(self):
+        with mock.patch('app_shops.facets.compute_facet_counts', wraps=compute_facet_counts) as compute:
+            self.assertEqual(get_facets()['in_stock'], 4)
+            self.pay(self.items[0], 1)
+            self.assertEqual(get_facets()['in_stock'], 4)
+            self.assertEqual(compute.call_count, 1)
+            self.pay(self.items[0], 4)
+            self.assertEqual(get_facets()['in_stock'], 3)
+            self.assertEqual(compute.call_count, 2)
+
+    def test_item_change_moving_facets_counts_again(self):
+        self.assertEqual(get_facets()['offer'], 0)
+        item = self.items[1]
+        with self.captureOnCommitCallbacks(execute=True):
+            item.description = 'other'
+            item.save()
+        self.assertEqual(get_facets()['offer'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            item.is_offer = True
+            item.save()
+        self.assertEqual(get_facets()['offer'], 1)
+
+
+class CartBufferTest(ShopTestCase):
+
+    def test_adds_are_written_when_cart_is_shown(self):
+        self.client.login(username='buyer', password=PASSWORD)
+        self.add(self.items[0])
+        self.add(self.items[0])
+        self.add(self.items[1])
+        self.assertEqual(self.cart(self.buyer), {})
+        self.client.get(reverse('cart'))
+        self.assertEqual(self.cart(self.buyer), {self.items[0].id: 2, self.items[1].id: 1})
+        self.assertNotIn(CART_BUFFER_KEY, self.client.session)
+
+    def test_full_buffer_is_written(self):
+        self.client.login(username='buyer', password=PASSWORD)
+        with mock.patch('app_shops.cart.CART_BUFFER_SIZE', 2):
+            self.add(self.items[0])
+            self.assertEqual(self.cart(self.buyer), {})
+            self.add(self.items[1])
+        self.assertEqual(self.cart(self.buyer), {self.items[0].id: 1, self.items[1].id: 1})
+
+    def test_quantity_of_item_in_cart_is_increased(self):
+        Cart.objects.create(user=self.buyer, item=self.items[0], quantity=3)
+        self.client.login(username='buyer', password=PASSWORD)
+        self.add(self.items[0])
+        self.client.get(reverse('cart'))
+        self.assertEqual(self.cart(self.buyer), {self.items[0].id: 4})
+
+    def test_anonymous_cart_is_merged_at_login(self):
+        self.add(self.items[2])
+        self.client.post(reverse('login'), {'username': 'buyer', 'password': PASSWORD})
+        self.assertEqual(self.cart(self.buyer), {self.items[2].id: 1})
+
+    def test_buffer_is_written_at_logout(self):
+        self.client.login(username='buyer', password=PASSWORD)
+        self.add(self.items[3])
+        self.client.get(reverse('logout'))
+        self.assertEqual(self.cart(self.buyer), {self.items[3].id: 1})
+
+    def test_ajax_add_returns_cart_totals(self):
+        self.add(self.items[0])
+        response = self.add(self.items[1], HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json(), {'lines': 2, 'total_cost': '21.00'})
+
+    def test_unknown_item_is_not_buffered(self):
+        response = self.client.post(reverse('add_to_cart'), {'add': 999999}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.session.get(CART_BUFFER_KEY, {}), {})
+
+    def test_add_redirects_to_next(self):
+        response = self.client.post(reverse('add_to_cart'), {'add': self.items[0].id, 'next': '/shops/promotions/'})
+        self.assertRedirects(response, '/shops/promotions/', fetch_redirect_response=False)
+        response = self.client.post(reverse('add_to_cart'), {'add': self.items[0].id, 'next': 'http://example.com/'})
+        self.assertRedirects(response, reverse('detail_item', args=[self.items[0].id]),
+                             fetch_redirect_response=False)
+
+
+class SyncTest(ShopTestCase):
+
+    def sync(self, changes, shop=None, **extra):
+        shop = shop or self.shop
+        return self.client.post(reverse('api_sync_items', args=[shop.id]), json.dumps({'items': changes}),
+                                content_type='application/json', **extra)
+
+    def test_changes_are_applied_and_conflicts_reported(self):
+        token = new_sync_token(self.shop)
+        item, other = self.items[0], self.items[1]
+        response = self.sync([{'code': item.code, 'version': item.version, 'price': '9.50', 'amount': 7},
+                              {'code': other.code, 'version': other.version + 5, 'price': '1.00'},
+                              {'code': 999999, 'amount': 1},
+                              {'code': self.items[2].code, 'price': 'abc'}],
+                             HTTP_AUTHORIZATION=f'Token {token}')
+        report = response.json()
+        self.assertEqual(report['updated'], [{'code': item.code, 'version': item.version + 1}])
+        self.assertEqual(report['conflicts'], [{'code': other.code, 'reason': 'version', 'version': other.version},
+                                               {'code': 999999, 'reason': 'not_found'}])
+        self.assertEqual([error['code'] for error in report['errors']], [self.items[2].code])
+        item.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((item.price, item.amount), (Decimal('9.50'), 7))
+        self.assertEqual(other.price, Decimal('11'))
+
+    def test_token_is_required(self):
+        other_shop = Shop.objects.create(seller=self.seller, name='other', tags='')
+        token = new_sync_token(other_shop)
+        change = [{'code': self.items[0].code, 'amount': 1}]
+        self.assertEqual(self.sync(change).status_code, 401)
+        self.assertEqual(self.sync(change, HTTP_AUTHORIZATION='Token wrong').status_code, 401)
+        self.assertEqual(self.sync(change, HTTP_AUTHORIZATION=f'Token {token}').status_code, 401)
+        new_sync_token(self.shop)
+        self.assertEqual(self.sync(change, HTTP_AUTHORIZATION=f'Token {token}').status_code, 401)
+
+    def test_session_sync_is_allowed_to_owner_only(self):
+        url = reverse('sync_items', args=[self.shop.id])
+        data = json.dumps({'items': [{'code': self.items[0].code, 'amount': 1}]})
+        other = User.objects.create_user('other', password=PASSWORD)
+        other.user_permissions.add(*Permission.objects.filter(codename__in=['change_shop', 'change_item']))
+        self.client.login(username='other', password=PASSWORD)
+        self.assertEqual(self.client.post(url, data, content_type='application/json').status_code, 403)
+        self.client.login(username='seller', password=PASSWORD)
+        response = self.client.post(url, data, content_type='application/json')
+        self.assertEqual(len(response.json()['updated']), 1)
+
+
+class ArchiveTest(ShopTestCase):
+
+    def order(self, code, status, days_ago):
+        order = Order.objects.create(user=self.buyer, code=code, status=status)
+        Order.objects.filter(id=order.id).update(created=tz.now() - timedelta(days=days_ago))
+        OrderedItem.objects.create(order=order, item=self.items[0], user=self.buyer, quantity=2, total_cost=20)
+        return order
+
+    def test_old_bought_orders_are_moved(self):
+        old = [self.order(f'old{index}', 'b', 400) for index in range(3)]
+        self.order('recent', 'b', 10)
+        self.order('unpaid', 'o', 400)
+        self.assertEqual(archive_orders(archive_cutoff(365), batch_size=2), 3)
+        self.assertEqual(set(Order.objects.values_list('code', flat=True)), {'recent', 'unpaid'})
+        self.assertEqual(set(ArchivedOrder.objects.values_list('id', flat=True)), {order.id for order in old})
+        self.assertEqual(ArchivedOrderedItem.objects.filter(order_id__in=[order.id for order in old]).count(), 3)
+        self.assertEqual(OrderedItem.objects.count(), 2)
+
+    def test_orders_with_the_same_code_are_archived(self):
+        # codes are made of user id and time to the second
+        self.order('same', 'b', 400)
+        self.order('same', 'b', 400)
+        self.assertEqual(archive_orders(archive_cutoff(365)), 2)
+        self.assertEqual(ArchivedOrder.objects.filter(code='same').count(), 2)
+
+    def test_history_shows_live_and_archived_orders(self):
+        self.order('old', 'b', 400)
+        self.order('recent', 'b', 10)
+        archive_orders(archive_cutoff(365))
+        self.client.login(username='buyer', password=PASSWORD)
+        response = self.client.get(reverse('order_history', args=[self.buyer.id]))
+        self.assertEqual([order['code'] for order in response.context['item_list']], ['recent', 'old'])
+
+    def test_sales_export_includes_archived_orders(self):
+        self.order('old', 'b', 400)
+        self.order('recent', 'b', 10)
+        self.order('unpaid', 'o', 10)
+        archive_orders(archive_cutoff(365))
+        self.client.login(username='seller', password=PASSWORD)
+        response = self.client.get(reverse('export_sales', args=[self.shop.id, 'jsonl']))
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['order'] for row in rows], ['old', 'recent'])
+
+
+class EstimatedCountPaginatorTest(ShopTestCase):
+
+    def test_sqlite_is_counted_exactly(self):
+        Item.objects.filter(id__in=[item.id for item in self.items[1:]]).delete()
+        self.assertIsNone(estimate_count(Item))
+        with mock.patch('app_shops.paginators.ESTIMATED_COUNT_THRESHOLD', 0):
+            paginator = EstimatedCountPaginator(Item.objects.order_by('id'), 2)
+            self.assertEqual(paginator.count, 1)
+            self.assertFalse(paginator.estimated)
+
+    def test_filtered_list_is_counted_exactly(self):
+        with mock.patch('app_shops.paginators.estimate_count', return_value=1000) as estimate:
+            paginator = EstimatedCountPaginator(Item.objects.filter(price__gt=11).order_by('id'), 2)
+            self.assertEqual(paginator.count, 2)
+        estimate.assert_not_called()
+
+    def test_pages_past_estimate_are_empty(self):
+        with mock.patch('app_shops.paginators.estimate_count', return_value=100000):
+            paginator = EstimatedCountPaginator(Item.objects.order_by('id'), 2)
+            self.assertEqual(paginator.count, 100000)
+            self.assertTrue(paginator.estimated)
+            self.assertEqual(len(paginator.page(2).object_list), 2)
+            self.assertEqual(list(paginator.page(40).object_list), [])
+            self.assertEqual(list(paginator.page(paginator.num_pages + 1).object_list), [])
+            with self.assertRaises(EmptyPage):
+                paginator.page(0)
+
+    def test_small_table_past_end_raises(self):
+        paginator = EstimatedCountPaginator(Item.objects.order_by('id'), 2)
+        with self.assertRaises(EmptyPage):
+            paginator.page(3)
+
+
+class UnusedFilesTest(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def stored(self):
+        return set(content_storage.stored_names())
+
+    def test_logo_and_used_images_are_kept(self):
+        logo = default_storage.save('files/logo.png', ContentFile(b'logo'))
+        Shop.objects.filter(id=self.shop.id).update(logo=logo)
+        image = File.objects.create(item=self.items[0], file=ContentFile(b'image', name='image.png'))
+        unused = content_storage.save('unused.png', ContentFile(b'unused'))
+        with mock.patch('app_shops.storage.FILE_LINK_GRACE', 0):
+            call_command('delete_unused_files', stdout=io.StringIO())
+        self.assertEqual(self.stored(), {logo, image.file.name})
+        self.assertNotIn(unused, self.stored())
+
+    def test_image_linked_by_upload_is_not_deleted(self):
+        image = File.objects.create(item=self.items[0], file=ContentFile(b'image', name='a.png'))
+        # an upload of the same content links to the stored file before its row is committed
+        linked = content_storage.save('b.png', ContentFile(b'image'))
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertIn(linked, self.stored())
+        File.objects.create(item=self.items[1], file=linked)
+        with mock.patch('app_shops.storage.FILE_LINK_GRACE', 0):
+            call_command('delete_unused_files', stdout=io.StringIO())
+        self.assertIn(linked, self.stored())
+
+    def test_deleted_image_is_removed_after_grace(self):
+        image = File.objects.create(item=self.items[0], file=ContentFile(b'image', name='a.png'))
+        with mock.patch('app_shops.storage.FILE_LINK_GRACE', 0), self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertEqual(self.stored(), set())
+
+
+class RateLimitTest(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        path = tempfile.mktemp()
+        self.addCleanup(lambda: os.path.exists(path) and os.remove(path))
+        self.buckets = ratelimit.SharedBuckets(path, slots=16)
+        for patcher in (mock.patch('app_shops.ratelimit.buckets', self.buckets),
+                        mock.patch.dict('app_shops.ratelimit.RATE_LIMIT_VIEWS', {'login': 'auth'}),
+                        mock.patch.dict('app_shops.ratelimit.RATE_LIMITS', {'auth': (0.001, 2)}),
+                        mock.patch('app_shops.ratelimit.RATE_LIMIT_TRUSTED_PROXIES', ['10.0.0.1'])):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def login(self, **extra):
+        return self.client.post(reverse('login'), {'username': 'buyer', 'password': 'wrong'}, **extra).status_code
+
+    def test_bucket_is_emptied_and_refilled(self):
+        self.assertEqual(self.buckets.take('key', 1, 2, now=100), 0)
+        self.assertEqual(self.buckets.take('key', 1, 2, now=100), 0)
+        self.assertEqual(self.buckets.take('key', 1, 2, now=100), 1)
+        self.assertEqual(self.buckets.take('key', 1, 2, now=101), 0)
+
+    def test_keys_of_one_slot_share_the_bucket(self):
+        buckets = ratelimit.SharedBuckets(self.buckets.path + '-one', slots=1)
+        self.addCleanup(os.remove, buckets.path)
+        self.assertEqual(buckets.take('first', 1, 2, now=100), 0)
+        self.assertEqual(buckets.take('second', 1, 2, now=100), 0)
+        # a new key does not get a full bucket
+        self.assertGreater(buckets.take('third', 1, 2, now=100), 0)
+
+    def test_clients_behind_trusted_proxy_have_own_buckets(self):
+        proxy = {'REMOTE_ADDR': '10.0.0.1'}
+        self.assertEqual([self.login(HTTP_X_FORWARDED_FOR='1.1.1.1', **proxy) for _ in range(3)], [200, 200, 429])
+        self.assertEqual(self.login(HTTP_X_FORWARDED_FOR='2.2.2.2', **proxy), 200)
+        # the start of the header is set by the client and is not trusted
+        self.assertEqual(self.login(HTTP_X_FORWARDED_FOR='3.3.3.3, 1.1.1.1', **proxy), 429)
+
+    def test_forwarded_header_of_untrusted_address_is_ignored(self):
+        self.assertEqual([self.login(REMOTE_ADDR='5.5.5.5', HTTP_X_FORWARDED_FOR=f'{index}.0.0.9')
+                          for index in range(1, 4)], [200, 200, 429])
+
+
+class ItemAdminTest(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser('admin', password=PASSWORD))
+
+    def test_number_is_looked_up_by_code(self):
+        response = self.client.get(reverse('admin:app_shops_item_changelist'), {'q': '1001'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.items[1]])
+        response = self.client.get(reverse('admin:app_shops_item_changelist'), {'q': 'ITEM'})
+        self.assertEqual(len(response.context['cl'].result_list), 4)
+
+    def test_counters_are_read_only(self):
+        response = self.client.get(reverse('admin:app_shops_item_change', args=[self.items[0].id]))
+        self.assertContains(response, 'name="price"')
+        for name in ('version', 'sold_total', 'sold_recent'):
+            self.assertNotContains(response, f'name="{name}"')
+
+    def test_order_is_looked_up_by_exact_code(self):
+        Order.objects.create(user=self.buyer, code='A-1')
+        response = self.client.get(reverse('admin:app_shops_order_changelist'), {'q': 'A-1'})
+        self.assertEqual(len(response.context['cl'].result_list), 1)
+        response = self.client.get(reverse('admin:app_shops_order_changelist'), {'q': 'a-1'})
+        self.assertEqual(len(response.context['cl'].result_list), 0)
+
+
+class UploadTest(ShopTestCase):
+
+    def test_rows_are_counted_one_by_one(self):
+        self.client.login(username='seller', password=PASSWORD)
+        content = ('2000,new,5,description,1\n1000,old,6,description,2\n'
+                   '2001,bad,price,description,1\n2002,next,5,description,1\n2003,last,5,description,1\n')
+        with mock.patch('app_shops.views.CSV_IMPORT_ROWS.inc') as inc:
+            self.client.post(reverse('upload_item', args=[self.shop.id]),
+                             {'file': ContentFile(content.encode(), name='items.csv')})
+        self.assertEqual(inc.call_args_list, [mock.call(result='created'), mock.call(result='updated'),
+                                              mock.call(result='failed'), mock.call(2, result='skipped')])
+
+
+class QueryTimerTest(ShopTestCase):
+
+    def test_middlewares_share_one_timer(self):
+        request = RequestFactory().get('/')
+        wrappers = len(connection.execute_wrappers)
+        with ratelimit.query_timer(request) as outer:
+            with ratelimit.query_timer(request) as inner:
+                self.assertIs(inner, outer)
+                self.assertEqual(len(connection.execute_wrappers), wrappers + 1)
+                User.objects.count()
+        self.assertEqual(outer.count, 1)
+        self.assertEqual(len(connection.execute_wrappers), wrappers)
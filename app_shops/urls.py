@@ -1,10 +1,15 @@
 from django.urls import path
-from app_shops.views import *
+from app_shops.views import HomePageView, AllShopListView, view_cart, add_to_cart_view, ReplenishFundsView, order_payment_view, \
+    OrderListView, CreateShopView, ShopListView, ViewStatistics, items_in_shop, ShopEditView, ShopDetailView, \
+    ItemCreateView, upload_item_from_file, ItemEditView, item_detail_view, get_promotions, get_offers, \
+    get_bestsellers
+from app_shops import api, export, sync
 
 urlpatterns = [
     path('', HomePageView.as_view(), name='shops_home'),
     path('shops/', AllShopListView.as_view(), name='shop_list'),
     path('personal/cart/', view_cart, name='cart'),
+    path('cart/add/', add_to_cart_view, name='add_to_cart'),
     path('personal/<int:pk>/founds/', ReplenishFundsView.as_view(), name='replenish_funds'),
     path('personal/order/<str:code>/', order_payment_view, name='order'),
     path('personal/history/<int:pk>/', OrderListView.as_view(), name='order_history'),
@@ -12,12 +17,22 @@ urlpatterns = [
     path('my_shops/', ShopListView.as_view(), name='my_shop_list'),
     path('my_shops/<int:pk>/statistics/', ViewStatistics.as_view(), name='statistics'),
     path('my_shops/<int:pk>/', items_in_shop, name='items_in_shop'),
+    path('my_shops/<int:pk>/export/items.<str:file_format>', export.export_items, name='export_items'),
+    path('my_shops/<int:pk>/export/sales.<str:file_format>', export.export_sales, name='export_sales'),
     path('edit/<int:pk>/', ShopEditView.as_view(), name='edit_shop'),
     path('detail/<int:pk>/', ShopDetailView.as_view(), name='detail_shop'),
     path('item/<int:pk>/create/', ItemCreateView.as_view(), name='create_item'),
     path('item/<int:pk>/upload/', upload_item_from_file, name='upload_item'),
+    path('item/<int:pk>/sync/', sync.sync_items, name='sync_items'),
     path('item/<int:pk>/edit/', ItemEditView.as_view(), name='edit_item'),
     path('item/<int:pk>/', item_detail_view, name='detail_item'),
     path('promotions/', get_promotions, name='promotions'),
     path('special-offers/', get_offers, name='offers'),
+    path('bestsellers/', get_bestsellers, name='bestsellers'),
+    path('bestsellers/<int:pk>/', get_bestsellers, name='shop_bestsellers'),
+    path('api/shops/', api.shops_api, name='api_shops'),
+    path('api/items/', api.items_api, name='api_items'),
+    path('api/promotions/', api.promotions_api, name='api_promotions'),
+    path('api/offers/', api.offers_api, name='api_offers'),
+    path('api/shops/<int:pk>/sync/', sync.sync_items_api, name='api_sync_items'),
 ]
@@ -3,38 +3,77 @@ from django.contrib.auth.decorators import permission_required, login_required
 from django.contrib.auth.mixins import PermissionRequiredMixin, LoginRequiredMixin
 from django.core.cache import cache
 from django.core.paginator import Paginator
-from django.http import HttpResponse
-from django.shortcuts import render, redirect
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import render, redirect, get_object_or_404
+from django.utils.decorators import method_decorator
 from django.views import generic
-from app_shops.models import Shop, Item, File, Cart, OrderedItem, Order
+from django.views.decorators.http import condition, require_POST
+from django.utils.http import url_has_allowed_host_and_scheme
+from app_shops.models import Shop, Item, File, Cart, OrderedItem, Order, ArchivedOrder, ArchivedOrderedItem
 from django.urls import reverse_lazy, reverse
-from app_shops.forms import ItemForm, UploadFile, TimeInterval
+from app_shops.forms import ItemForm, UploadFile, TimeInterval, CatalogFilterForm
 from csv import reader
-from django.db import transaction, IntegrityError, connection, reset_queries
+from itertools import chain
+from django.db import transaction, IntegrityError
+from django.db.models import Exists, OuterRef
 from django.utils import timezone as tz
 from django.utils.translation import gettext_lazy as _
 from app_users.models import Profile
-from django.conf import settings
+from app_shops.cards import get_cards, invalidate_cards
+from app_shops.cart import add_to_cart, flush_cart, cart_lines, discard_from_buffer
+from app_shops.catalog import catalog_etag, shop_etag, bump_catalog, get_version
+from app_shops.facets import bump_facets, changes_facets, get_facets
+from app_shops.metrics import CACHE_REQUESTS, CHECKOUTS, PAYMENTS, CSV_IMPORT_ROWS
+from app_shops.page_cache import cache_anonymous_page
+from app_shops.popularity import SORT_ORDERS, add_sale
+from app_shops.recommendations import get_related_cards, record_order, item_etag, item_page_version
 
 
 logger = logging.getLogger(__name__)
 
 
+@method_decorator([condition(etag_func=catalog_etag), cache_anonymous_page()], name='dispatch')
 class HomePageView(generic.ListView):
     model = Item
     template_name = 'app_shops/home_page_2.html'
     context_object_name = 'item_list'
     paginate_by = 10
 
+    def get_sort(self):
+        sort = self.request.GET.get('sort')
+        return sort if sort in SORT_ORDERS else 'name'
+
+    def get_ordering(self):
+        return SORT_ORDERS[self.get_sort()]
+
+    def get_filter_form(self):
+        if not hasattr(self, '_filter_form'):
+            self._filter_form = CatalogFilterForm(self.request.GET)
+        return self._filter_form
+
     def get_queryset(self):
-        #reset_queries()
-        queryset = Item.objects.select_related('shop').only('name', 'shop__name').order_by('name')
-        """print(queryset)
-        print(connection.queries)
-        print(len(connection.queries))"""
-        return queryset
+        queryset = Item.objects.order_by(*self.get_ordering())
+        form = self.get_filter_form()
+        if form.is_valid():
+            queryset = form.filter(queryset)
+        return queryset.values_list('id', flat=True)
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['item_list'] = get_cards(context['item_list'])
+        context['sort'] = self.get_sort()
+        form = self.get_filter_form()
+        context['filter_form'] = form
+        context['facets'] = get_facets(form.cleaned_data if form.is_valid() else None)
+        query = self.request.GET.copy()
+        query.pop('page', None)
+        context['page_query'] = query.urlencode()
+        query.pop('sort', None)
+        context['filter_query'] = query.urlencode()
+        return context
 
+
+@method_decorator([condition(etag_func=catalog_etag), cache_anonymous_page()], name='dispatch')
 class AllShopListView(generic.ListView):
     """Show list of the shops in marketplace."""
     model = Shop
@@ -99,6 +138,16 @@ class ShopDetailView(LoginRequiredMixin, PermissionRequiredMixin, generic.ListVi
         return context
 
 
+def save_files(item, files):
+    """Save uploaded images of the item with one insert."""
+    if not files:
+        return
+    File.objects.bulk_create([File(item=item, file=file) for file in files])
+    # bulk_create does not send signals
+    bump_catalog(shop_id=item.shop_id, item_id=item.id)
+    invalidate_cards([item.id])
+
+
 class ItemCreateView(LoginRequiredMixin, PermissionRequiredMixin, generic.CreateView):
     """Add a new item to shop."""
     model = Item
@@ -114,13 +163,12 @@ class ItemCreateView(LoginRequiredMixin, PermissionRequiredMixin, generic.Create
         shop = Shop.objects.get(id=shop_id)
         form.instance.shop = shop
         item = form.save()
-        files = self.request.FILES.getlist('file')
-        for file in files:
-            file_model = File(item=item, file=file)
-            file_model.save()
+        save_files(item, self.request.FILES.getlist('file'))
         return super().form_valid(form)
 
 
+@condition(etag_func=item_etag)
+@cache_anonymous_page(item_page_version)
 def item_detail_view(request, pk):
     """Show item detail and add it to cart."""
     item = Item.objects.get(id=pk)
@@ -129,16 +177,11 @@ def item_detail_view(request, pk):
     amount = None
     if request.user.has_perm('app_shops.change_item'):
         amount = item.amount
-
-    if request.method == 'POST':
-        if request.user.is_authenticated:
-            item_id = request.POST.get('add')
-            obj, created = Cart.objects.get_or_create(user_id=request.user.id, item_id=item_id)
-        else:
-            return redirect(f'{settings.LOGIN_URL}?next={request.path}')
+    related_items = get_related_cards([item.id])
     return render(request, 'app_shops/detail_item.html',
                   {'item': item, 'description': description,
-                   'files': files, 'amount': amount})
+                   'files': files, 'amount': amount,
+                   'related_items': related_items})
 
 
 class ItemEditView(LoginRequiredMixin, PermissionRequiredMixin, generic.UpdateView):
@@ -152,14 +195,17 @@ class ItemEditView(LoginRequiredMixin, PermissionRequiredMixin, generic.UpdateVi
         return reverse_lazy('detail_item', args=[self.object.pk])
 
     def form_valid(self, form):
-        item = self.object
-        files = self.request.FILES.getlist('file')
-        for file in files:
-            file_model = File(item=item, file=file)
-            file_model.save()
+        save_files(self.object, self.request.FILES.getlist('file'))
         return super().form_valid(form)
 
 
+def count_failed_import(rows, imported):
+    """Count the row the import stopped at as failed and the rows after it as skipped."""
+    CSV_IMPORT_ROWS.inc(result='failed')
+    if rows - imported > 1:
+        CSV_IMPORT_ROWS.inc(rows - imported - 1, result='skipped')
+
+
 @login_required
 @permission_required('app_shops.change_shop', 'app_shops.change_item', raise_exception=True)
 def upload_item_from_file(request, pk):
@@ -170,21 +216,27 @@ def upload_item_from_file(request, pk):
             file = form.cleaned_data.get('file').read()
             file = file.decode('utf-8').split('\n')
             csv_reader = reader(file, quotechar='"')
+            rows = []
+            imported = 0
             try:
                 # code, name, price, description, amount
-                for row in csv_reader:
-                    if row:  # if not empty line
-                        # check if item's code does not already exist
-                        item, created = Item.objects.update_or_create(
-                            code=row[0],
-                            defaults={"shop_id": pk, "name": row[1],
-                                      "price": row[2], "description": row[3],
-                                      "amount": row[4]})
+                rows = [row for row in csv_reader if row]  # if not empty line
+                for row in rows:
+                    # check if item's code does not already exist
+                    item, created = Item.objects.update_or_create(
+                        code=row[0],
+                        defaults={"shop_id": pk, "name": row[1],
+                                  "price": row[2], "description": row[3],
+                                  "amount": row[4]})
+                    CSV_IMPORT_ROWS.inc(result='created' if created else 'updated')
+                    imported += 1
                 return redirect(reverse('detail_shop', args=[pk]))
             except IntegrityError:
                 transaction.rollback()
+                count_failed_import(len(rows), imported)
                 return HttpResponse(content='Товары не обновлены из-за ошибок в файле')
             except Exception as e:
+                count_failed_import(len(rows), imported)
                 return HttpResponse(content=f'Товары не обновлены из-за неправильного '
                                             f'формата данных в файле.\n{e}')
     else:
@@ -193,33 +245,16 @@ def upload_item_from_file(request, pk):
                   {'form': form})
 
 
+@condition(etag_func=shop_etag)
 def items_in_shop(request,  pk):
     """Show a list of items in shops and add them to cart."""
-    #item_list = Item.objects.filter(shop_id=pk).only('id', 'name', 'price')
-    file_list = File.objects.select_related('item').filter(item__shop_id=pk).\
-        only('file', 'item_id', 'item__name', 'item__price')
-
-    # Select only first image for each item
-    unique_files = dict()
-    for file in file_list:
-        item_id = file.item_id
-        if unique_files.get(item_id) is None:
-            unique_files[item_id] = {'item_name': file.item.name,
-                                     'file': file.file,
-                                     'item_price': file.item.price,
-                                     'item_id': item_id
-                                     }
-    unique_files = list(unique_files.values())
-    paginator = Paginator(unique_files, 5)
+    # only items with images
+    item_ids = Item.objects.filter(shop_id=pk).filter(Exists(File.objects.filter(item_id=OuterRef('pk')))).\
+        values_list('id', flat=True)
+    paginator = Paginator(item_ids, 5)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
-
-    if request.method == 'POST':
-        if request.user.is_authenticated:
-            item_id = request.POST.get('add')
-            obj, created = Cart.objects.get_or_create(user_id=request.user.id, item_id=item_id)
-        else:
-            return redirect(f'{settings.LOGIN_URL}?next={request.path}')
+    page_obj.object_list = get_cards(page_obj.object_list)
     return render(request, 'app_shops/view_items_in_shop.html',
                   {'page_obj': page_obj})
 
@@ -227,13 +262,15 @@ def items_in_shop(request,  pk):
 @login_required
 def view_cart(request):
     """View a list of items in cart and place them to order."""
-    cart_list = Cart.objects.select_related('item').filter(user=request.user.id).only('quantity', 'item__name',
-                                                                                      'item__price',
-                                                                                      'item__amount')
-    total_cost = sum([order.item.price * order.quantity
-                      for order in cart_list])
+    flush_cart(request)
+    cart_list = Cart.objects.filter(user=request.user.id).only('quantity', 'item_id')
     # list of item_id
     item_ids = [order.item_id for order in cart_list]
+    cards = {card['item_id']: card for card in get_cards(item_ids)}
+    for order in cart_list:
+        order.card = cards[order.item_id]
+    total_cost = sum([order.card['item_price'] * order.quantity
+                      for order in cart_list])
 
     if request.method == 'POST':
         # dict {item_ind: quantity}
@@ -244,6 +281,7 @@ def view_cart(request):
         if action == 'clean':  # clear the cart
             cart_list.delete()
             total_cost = 0
+            CHECKOUTS.inc(outcome='cleaned')
         with transaction.atomic():
             if action == 'order':  # form the order
                 # selected items to be placed in the order
@@ -265,17 +303,51 @@ def view_cart(request):
                     deleted_item = Cart.objects.get(item=item, user=request.user)
                     deleted_item.delete()
                 OrderedItem.objects.bulk_create(ordered_items)
+                CHECKOUTS.inc(outcome='ordered')
                 log_msg = f'Заказ #{order.id} сформирован. Пользователь:: {request.user.username}'
                 logger.info(log_msg)
                 return redirect(reverse('order', args=[code]))
+    related_items = get_related_cards(item_ids)
     return render(request, 'app_shops/cart.html',
-                  {'order_list': cart_list, 'total_cost': total_cost})
+                  {'order_list': cart_list, 'total_cost': total_cost,
+                   'related_items': related_items})
+
+
+@require_POST
+def add_to_cart_view(request):
+    """Add item to cart, answer AJAX requests with number of lines and total cost of the cart."""
+    item_id = request.POST.get('add')
+    added = add_to_cart(request, item_id)
+    lines = cart_lines(request) if added else {}
+    if added and int(item_id) not in lines:
+        # no such item
+        discard_from_buffer(request, item_id)
+        added = False
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        if not added:
+            return JsonResponse({'error': str(_('товар не найден'))}, status=404)
+        total_cost = sum(quantity * price for quantity, price in lines.values())
+        return JsonResponse({'lines': len(lines), 'total_cost': str(total_cost)})
+    next_url = request.POST.get('next')
+    if not url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()},
+                                           require_https=request.is_secure()):
+        next_url = reverse('detail_item', args=[item_id]) if added else reverse('shops_home')
+    return redirect(next_url)
 
 
 @login_required
 def order_payment_view(request, code):
     """Show payment view."""
-    order = Order.objects.get(code=code)
+    order = Order.objects.filter(code=code).first()
+    if order is None:
+        # old bought orders are moved to archive
+        order = get_object_or_404(ArchivedOrder, code=code)
+        queryset = order.ordered_items.select_related('item').only('quantity', 'total_cost',
+                                                                  'item__name', 'item__price')
+        total_cost = sum([obj.total_cost for obj in queryset])
+        return render(request, 'app_shops/view_items_in_order.html',
+                      {'item_list': queryset, 'total_cost': total_cost,
+                       'order': order})
     queryset = OrderedItem.objects.select_related('item').filter(order_id=order.id).only('quantity', 'total_cost',
                                                                                          'item__name',
                                                                                          'item__price')
@@ -302,17 +374,32 @@ def order_payment_view(request, code):
                 if new_status != old_status:
                     log_msg = f'Пользователь:: {request.user.username}. Статус покупателя повышен:: {new_status}'
                     logger.info(log_msg)
-                # reduce the available items in shop
-                items = []
+                # reduce the available items in shop, the rows are locked so a sync
+                # can not change them between reading and writing
+                items = Item.objects.select_for_update().in_bulk([obj.item_id for obj in queryset])
+                sold_out = False
                 for ordered_item in queryset:
-                    item = Item.objects.get(id=ordered_item.item_id)
+                    item = items[ordered_item.item_id]
+                    sold_out = sold_out or changes_facets({'amount': item.amount},
+                                                          {'amount': item.amount - ordered_item.quantity})
                     item.amount -= ordered_item.quantity
-                    items.append(item)
-                Item.objects.bulk_update(items, ['amount'])
+                    item.version += 1
+                    add_sale(item, ordered_item.quantity, order.created)
+                items = list(items.values())
+                Item.objects.bulk_update(items, ['amount', 'version', 'sold_total', 'sold_recent'])
+                for item in items:
+                    bump_catalog(shop_id=item.shop_id, item_id=item.id)
+                if sold_out:
+                    # facet counts are kept by sales unless an item is out of stock
+                    bump_facets()
+                invalidate_cards([item.id for item in items])
+                record_order(order.id)
                 log_msg = f'Заказ #{order.id} оплачен. С пользователя {request.user.username} ' \
                           f'списано {total_cost} руб.'
                 logger.info(log_msg)
+                PAYMENTS.inc(outcome='paid')
                 return HttpResponse(_('платеж успешно проведен').capitalize())
+            PAYMENTS.inc(outcome='insufficient_funds')
     return render(request, 'app_shops/view_items_in_order.html',
                   {'item_list': queryset, 'total_cost': total_cost,
                    'order': order})
@@ -345,77 +432,74 @@ class OrderListView(LoginRequiredMixin, generic.ListView):
 
     def get_queryset(self):
         user_id = self.kwargs.get('pk')
-        queryset = self.model.objects.filter(user_id=user_id).defer('user_id')
-        return queryset
+        # old orders are read from archive
+        queryset = self.model.objects.filter(user_id=user_id).values('code', 'created', 'status').order_by()
+        archived = ArchivedOrder.objects.filter(user_id=user_id).values('code', 'created', 'status').order_by()
+        return queryset.union(archived, all=True).order_by('-created')
 
 
+@cache_anonymous_page()
 def get_promotions(request):
     """Show a list of promotions and allow to add them to cart."""
-    promotions_cache_key = f'promotions:{request.user.username}'
-    #item_list = Item.objects.filter(is_promotion=True).only('name', 'price')
-    file_list = File.objects.select_related('item').filter(item__is_promotion=True). \
-        only('file', 'item_id', 'item__name', 'item__price')
-
-    cached_data = cache.get_or_set(promotions_cache_key, file_list, 60 * 60)
-
-    # Select only first image for each item
-    unique_files = dict()
-    for file in cached_data:
-        item_id = file.item_id
-        if unique_files.get(item_id) is None:
-            unique_files[item_id] = {'item_name': file.item.name,
-                                     'file': file.file,
-                                     'item_price': file.item.price,
-                                     'item_id': item_id
-                                     }
-    unique_files = list(unique_files.values())
-    paginator = Paginator(unique_files, 5)
+    promotions_cache_key = f'promotions:{get_version()}'
+    # only items with images
+    item_list = Item.objects.filter(is_promotion=True).filter(Exists(File.objects.filter(item_id=OuterRef('pk')))).\
+        values_list('id', flat=True)
+
+    cached_data = cache.get(promotions_cache_key)
+    if cached_data is None:
+        CACHE_REQUESTS.inc(list='promotions', result='miss')
+        cached_data = list(item_list)
+        cache.set(promotions_cache_key, cached_data, 60 * 60)
+    else:
+        CACHE_REQUESTS.inc(list='promotions', result='hit')
+    paginator = Paginator(cached_data, 5)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
-
-    if request.method == 'POST':
-        if request.user.is_authenticated:
-            item_id = request.POST.get('add')
-            obj, created = Cart.objects.get_or_create(user_id=request.user.id, item_id=item_id)
-        else:
-            return redirect(f'{settings.LOGIN_URL}?next={request.path}')
+    page_obj.object_list = get_cards(page_obj.object_list)
     return render(request, 'app_shops/view_promotions.html',
                   {'page_obj': page_obj})
 
 
+@cache_anonymous_page()
 def get_offers(request):
     """ show a list of special offers and allow to add them to cart """
-    offers_cache_key = f'offers:{request.user.username}'
-    #item_list = Item.objects.filter(is_offer=True).only('name', 'price')
-    file_list = File.objects.select_related('item').filter(item__is_offer=True). \
-        only('file', 'item_id', 'item__name', 'item__price')
-    cached_data = cache.get_or_set(offers_cache_key, file_list, 60 * 60)
-
-    # Select only first image for each item
-    unique_files = dict()
-    for file in cached_data:
-        item_id = file.item_id
-        if unique_files.get(item_id) is None:
-            unique_files[item_id] = {'item_name': file.item.name,
-                                     'file': file.file,
-                                     'item_price': file.item.price,
-                                     'item_id': item_id
-                                     }
-    unique_files = list(unique_files.values())
-    paginator = Paginator(unique_files, 10)
+    offers_cache_key = f'offers:{get_version()}'
+    # only items with images
+    item_list = Item.objects.filter(is_offer=True).filter(Exists(File.objects.filter(item_id=OuterRef('pk')))).\
+        values_list('id', flat=True)
+
+    cached_data = cache.get(offers_cache_key)
+    if cached_data is None:
+        CACHE_REQUESTS.inc(list='offers', result='miss')
+        cached_data = list(item_list)
+        cache.set(offers_cache_key, cached_data, 60 * 60)
+    else:
+        CACHE_REQUESTS.inc(list='offers', result='hit')
+    paginator = Paginator(cached_data, 10)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
-
-    if request.method == 'POST':
-        if request.user.is_authenticated:
-            item_id = request.POST.get('add')
-            obj, created = Cart.objects.get_or_create(user_id=request.user.id, item_id=item_id)
-        else:
-            return redirect(f'{settings.LOGIN_URL}?next={request.path}')
+    page_obj.object_list = get_cards(page_obj.object_list)
     return render(request, 'app_shops/view_offers.html',
                   {'page_obj': page_obj})
 
 
+@cache_anonymous_page()
+def get_bestsellers(request, pk=None):
+    """Show best selling items of all shops or of one shop."""
+    sort = 'recent' if request.GET.get('sort') == 'recent' else 'popular'
+    item_list = Item.objects.filter(sold_total__gt=0)
+    if pk is not None:
+        item_list = item_list.filter(shop_id=pk)
+    item_list = item_list.order_by(*SORT_ORDERS[sort]).values_list('id', flat=True)
+    paginator = Paginator(item_list, 10)
+    page_number = request.GET.get('page')
+    page_obj = paginator.get_page(page_number)
+    page_obj.object_list = get_cards(page_obj.object_list)
+    return render(request, 'app_shops/view_bestsellers.html',
+                  {'page_obj': page_obj, 'sort': sort, 'page_query': f'sort={sort}'})
+
+
 class ViewStatistics(LoginRequiredMixin, PermissionRequiredMixin, generic.View):
     """Show sale statistics for shop."""
     permission_required = ['app_shops.change_shop', 'app_shops.change_item']
@@ -432,10 +516,17 @@ class ViewStatistics(LoginRequiredMixin, PermissionRequiredMixin, generic.View):
             queryset = OrderedItem.objects.select_related('item'). \
                 select_related('order').filter(order__created__range=(start_date, end_date)).\
                 filter(item__shop_id=pk).only('item__id', 'quantity', 'item__code', 'item__name', 'order__id')
+            querysets = [queryset]
+            # old orders are read from archive
+            if ArchivedOrder.objects.filter(created__range=(start_date, end_date)).exists():
+                archived = ArchivedOrderedItem.objects.select_related('item'). \
+                    filter(order__created__range=(start_date, end_date)).\
+                    filter(item__shop_id=pk).only('item__id', 'quantity', 'item__code', 'item__name')
+                querysets.append(archived)
 
             # dict for unique items
             item_dict = dict()
-            for item in queryset:
+            for item in chain(*querysets):
                 if item.item_id not in item_dict:
                     item_dict[item.item_id] = {'code': item.item.code,
                                                'quantity': item.quantity,
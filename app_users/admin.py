@@ -1,9 +1,13 @@
 from django.contrib import admin
+from app_shops.admin import LargeTableAdmin
 from app_users.models import Profile
 
 
-class ProfileAdmin(admin.ModelAdmin):
+class ProfileAdmin(LargeTableAdmin):
     list_display = ['user', 'registration_date', 'funds', 'is_seller', 'avatar']
+    list_select_related = ['user']
+    autocomplete_fields = ['user']
+    search_fields = ['^user__username']
 
 
 admin.site.register(Profile, ProfileAdmin)
@@ -0,0 +1,63 @@
+"""Throughput of the JSON catalog API against the equivalent HTML pages.
+
+Usage (from the project root):
+    python benchmarks/catalog_api.py --requests 200 [--cold]
+
+--cold clears the cache before every request, so neither the page cache
+nor item cards help and every request renders from the database.
+"""
+import argparse
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.chdir(BASE_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djloggingprofiling.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.cache import cache  # noqa: E402
+from django.test import Client  # noqa: E402
+
+PAIRS = [
+    ('/shops/', '/shops/api/items/?limit=10&fields=id,name,shop_id'),
+    ('/shops/shops/', '/shops/api/shops/?limit=10'),
+    ('/shops/promotions/', '/shops/api/promotions/?limit=5&fields=id,name,price,images'),
+    ('/shops/special-offers/', '/shops/api/offers/?limit=10&fields=id,name,price,images'),
+]
+
+
+def run(client, url, requests, cold):
+    """Return requests per second and size of the last response."""
+    size = 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        if cold:
+            cache.clear()
+        response = client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        size = len(response.content)
+    elapsed = time.perf_counter() - started
+    return requests / elapsed, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--cold', action='store_true')
+    args = parser.parse_args()
+
+    client = Client(HTTP_HOST='localhost')
+    print(f'{"url":<60} {"req/s":>10} {"bytes":>10}')
+    for html_url, api_url in PAIRS:
+        for url in (html_url, api_url):
+            client.get(url)  # warm up
+            rate, size = run(client, url, args.requests, args.cold)
+            print(f'{url:<60} {rate:>10.1f} {size:>10}')
+
+
+if __name__ == '__main__':
+    main()
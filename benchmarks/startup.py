@@ -0,0 +1,53 @@
+"""Startup time of the project with development and production settings.
+
+Usage (from the project root):
+    python benchmarks/startup.py --runs 5
+
+For every settings module measures ``manage.py check`` and import of the
+WSGI application (django.setup, URLconf is not loaded, templates are
+preloaded when PRELOAD_TEMPLATES is on) in a fresh interpreter.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETTINGS = ['djloggingprofiling.settings', 'djloggingprofiling.settings_production']
+
+COMMANDS = {
+    'manage.py check': [sys.executable, 'manage.py', 'check'],
+    'wsgi import': [sys.executable, '-c', 'import djloggingprofiling.wsgi'],
+}
+
+
+def measure(command, settings_module, runs):
+    """Return list of wall times of the command in seconds."""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(command, cwd=BASE_DIR, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"settings":<42} {"command":<18} {"median, ms":>11} {"min, ms":>9}')
+    for settings_module in SETTINGS:
+        for name, command in COMMANDS.items():
+            times = measure(command, settings_module, args.runs)
+            print(f'{settings_module:<42} {name:<18} '
+                  f'{statistics.median(times) * 1000:>11.0f} {min(times) * 1000:>9.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+"""Warm up a worker before it gets the first request."""
+import os
+
+from django.template import engines
+
+
+def preload_templates():
+    """Compile project templates, so the cached loader keeps them."""
+    loaded = 0
+    for engine in engines.all():
+        for template_dir in engine.engine.dirs:
+            for root, dirs, files in os.walk(template_dir):
+                for filename in files:
+                    if filename.endswith('.html'):
+                        name = os.path.relpath(os.path.join(root, filename), template_dir)
+                        engine.get_template(name.replace(os.sep, '/'))
+                        loaded += 1
+    return loaded
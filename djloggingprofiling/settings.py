@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,11 +46,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'app_shops.request_log.RequestLogMiddleware',
+    'app_shops.metrics.MetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'app_shops.ratelimit.RateLimitMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
@@ -60,7 +64,7 @@ ROOT_URLCONF = 'djloggingprofiling.urls'
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': ['templates'],
+        'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
@@ -140,13 +144,60 @@ LOGIN_REDIRECT_URL = '/shops/'
 
 LOGOUT_REDIRECT_URL = '/shops/'
 
-# Cache
+# Cache, shared by all worker processes: catalog versions, pages and item cards
+# written by one worker must be seen by the others
 CACHES = {
    'default': {
-      'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
-   }
+      'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+      'LOCATION': os.path.join(tempfile.gettempdir(), 'djloggingprofiling-cache'),
+      'OPTIONS': {
+         'MAX_ENTRIES': 10000,
+      },
+   },
 }
 
+# Sessions are written to the database and read through the cache, culling of
+# the file cache only costs a database read, never a logged out user
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# Full-page cache of catalog pages for anonymous users, seconds
+PAGE_CACHE_TIMEOUT = 60 * 15
+
+PAGE_CACHE_STALE_TIMEOUT = 60 * 5
+
+# Bought orders older than this are moved to archive by archive_orders command
+ORDER_ARCHIVE_AFTER_DAYS = 365
+
+ORDER_ARCHIVE_BATCH_SIZE = 500
+
+# Items added to cart are written to the database in batches of this size or after this many seconds
+CART_BUFFER_SIZE = 10
+
+CART_BUFFER_MAX_AGE = 60 * 5
+
+# Queries slower than this are written to slow_queries.log with their plans, seconds
+SLOW_QUERY_THRESHOLD = 0.1
+
+# Token buckets of write requests, budget: (tokens per second, bucket size)
+RATE_LIMITS = {
+    'add_to_cart': (1, 20),
+    'auth': (0.1, 5),
+    'checkout': (0.5, 10),
+}
+
+# Reverse proxies in front of the site, anonymous clients are told apart by the X-Forwarded-For they set
+RATE_LIMIT_TRUSTED_PROXIES = []
+
+# Addresses allowed to read /metrics without a proxy, files of worker processes are kept in METRICS_DIR
+# (temporary directory by default)
+METRICS_ALLOWED_IPS = ['127.0.0.1']
+
+# Bearer token of /metrics, required instead of the addresses when set
+METRICS_TOKEN = None
+
+# Add to cart and auth requests get 503 while average query time is over this, seconds
+LOAD_SHEDDING_DB_LATENCY = 0.1
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -160,7 +211,11 @@ LOGGING = {
         'simple': {
             'format': '{levelname} {asctime} {module} {funcName} {message}',
             'style': '{',
-        }
+        },
+        'message': {
+            'format': '{message}',
+            'style': '{',
+        },
     },
     'handlers': {
         'file': {
@@ -168,12 +223,26 @@ LOGGING = {
             'filename': 'logging.log',
             'formatter': 'simple',
         },
+        'slow_queries': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': 'slow_queries.log',
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'formatter': 'message',
+        },
     },
     'root': {
         'handlers': ['file'],
         'level': 'INFO',
         'propagate': True,
     },
+    'loggers': {
+        'app_shops.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
 }
 
 INTERNAL_IPS = [
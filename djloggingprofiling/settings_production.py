@@ -0,0 +1,74 @@
+"""
+Production settings for djloggingprofiling project.
+
+Use with DJANGO_SETTINGS_MODULE=djloggingprofiling.settings_production.
+Debug tooling is left out and compiled templates are cached.
+"""
+
+import os
+
+from djloggingprofiling.settings import *  # noqa: F401,F403
+from djloggingprofiling.settings import INSTALLED_APPS, MIDDLEWARE, DATABASES, BASE_DIR
+
+SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', SECRET_KEY)  # noqa: F405
+
+DEBUG = False
+
+ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', 'localhost').split(',')
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app != 'debug_toolbar']
+
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE if not middleware.startswith('debug_toolbar')]
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [BASE_DIR / 'templates'],
+        'OPTIONS': {
+            'context_processors': [
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+            ],
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
+        },
+    },
+]
+
+# Compile project templates when the WSGI application is loaded
+PRELOAD_TEMPLATES = True
+
+DATABASES['default']['CONN_MAX_AGE'] = 60
+
+# Memcached shared by the workers of all hosts, the file cache of settings.py
+# is shared by the workers of one host only
+if os.environ.get('DJANGO_MEMCACHED_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': os.environ['DJANGO_MEMCACHED_LOCATION'].split(','),
+        },
+        'sessions': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': os.environ.get('DJANGO_MEMCACHED_SESSIONS_LOCATION',
+                                       os.environ['DJANGO_MEMCACHED_LOCATION']).split(','),
+            'KEY_PREFIX': 'sessions',
+        },
+    }
+    # memcached evicts the least recently used keys only, give sessions their
+    # own servers so the cart buffer of every click is not a database write
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
+    SESSION_CACHE_ALIAS = 'sessions'
+
+INTERNAL_IPS = []
+
+# comma separated addresses of the reverse proxies
+RATE_LIMIT_TRUSTED_PROXIES = [address for address in os.environ.get('DJANGO_TRUSTED_PROXIES', '').split(',') if address]
+
+# behind the reverse proxy /metrics is read with this token
+METRICS_TOKEN = os.environ.get('DJANGO_METRICS_TOKEN')
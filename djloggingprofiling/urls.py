@@ -18,10 +18,15 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from app_shops.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('shops/', include('app_shops.urls')),
     path('users/', include('app_users.urls')),
     path('i18n', include('django.conf.urls.i18n')),
-    path('__debug__/', include('debug_toolbar.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+if 'debug_toolbar' in settings.INSTALLED_APPS:
+    urlpatterns.append(path('__debug__/', include('debug_toolbar.urls')))
@@ -9,8 +9,13 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djloggingprofiling.settings')
 
 application = get_wsgi_application()
+
+if getattr(settings, 'PRELOAD_TEMPLATES', False):
+    from djloggingprofiling.preload import preload_templates
+    preload_templates()